@@ -5,6 +5,8 @@ import os
 import json
 import mtemsg
 from metrics import Metrics
+from structcache import StructureCache
+from recorder import MTERecorder
 
 class ASTS:
     MTE_OK = 0
@@ -91,7 +93,7 @@ class ASTS:
             print(param)
             print('=== end debug ===')
 
-    def __init__(self, LIBPATH = None, DEBUG = False):
+    def __init__(self, LIBPATH = None, DEBUG = False, CACHEPATH = None):
         self._DEBUG = DEBUG
         if LIBPATH == None:
             LIBPATH = os.path.dirname(os.path.abspath(__file__))
@@ -100,6 +102,11 @@ class ASTS:
         self.ConnStats = self.ConnectionStats()
         self._mtemsg = mtemsg.MTEMSG()
         self.Structure = None
+        self.ServInfo = None
+        self._Idx = ASTS.MTE_NOTCONNECTED
+        self._interface = None
+        self._structCache = StructureCache(CACHEPATH) if CACHEPATH is not None else None
+        self._recorder = None
 
         #char* MTEErrorMsg(int32_t code);
         self._lib.MTEErrorMsg.argtypes = [c_int32, ]
@@ -152,7 +159,32 @@ class ASTS:
         #int32_t MTEFreeBuffer(int32_t conno);
         self._lib.MTEFreeBuffer.argtypes = [c_int32, ]
         self._lib.MTEFreeBuffer.restype = c_int32
-
+        #int32_t MTEGetSnapshot(int32_t conno, char **buffer, int32_t *len);
+        self._lib.MTEGetSnapshot.argtypes = [c_int32, POINTER(POINTER(c_char)), POINTER(c_int32)]
+        self._lib.MTEGetSnapshot.restype = c_int32
+        #int32_t MTESetSnapshot(int32_t conno, const char *buffer, int32_t len, char *error);
+        self._lib.MTESetSnapshot.argtypes = [c_int32, c_char_p, c_int32, c_char_p]
+        self._lib.MTESetSnapshot.restype = c_int32
+        #int32_t MTEOpenTableAtSnapshot(int32_t conno, const char *name, const char *params, const char *snapshot, int32_t len, MTEMSG **msg);
+        self._lib.MTEOpenTableAtSnapshot.argtypes = [c_int32, c_char_p, c_char_p, c_char_p, c_int32, POINTER(POINTER(mtemsg.MTEMSG.MSG))]
+        self._lib.MTEOpenTableAtSnapshot.restype = c_int32
+        #int32_t MTEExecTrans(int32_t conno, const char *name, const char *params, char *error);
+        self._lib.MTEExecTrans.argtypes = [c_int32, c_char_p, c_char_p, c_char_p]
+        self._lib.MTEExecTrans.restype = c_int32
+        #int32_t MTEExecTransIP(int32_t conno, const char *name, const char *params, char *error, int32_t clientIP);
+        self._lib.MTEExecTransIP.argtypes = [c_int32, c_char_p, c_char_p, c_char_p, c_int32]
+        self._lib.MTEExecTransIP.restype = c_int32
+
+
+    def setRecorder(self, _recorder):
+        # MTERecorder for every raw reply of MTEStructure*, MTEOpenTable* and MTERefresh; None - stop recording
+        self._recorder = _recorder
+        if _recorder is not None and self._mtemsg.isMTEStructure():
+            _recorder.recordStructure(self._mtemsg.MTEStructure)
+
+    def _record(self, _type, _res, _name='', _arg=0):
+        if self._recorder is not None:
+            self._recorder.record(_type, _res, self._mtemsg.rawData(_res), _name, _arg)
 
     def ErrorMsg(self):
         return self._ErrorMsg.value.decode('cp1251')
@@ -175,6 +207,7 @@ class ASTS:
     #int32_t MTEConnect(const char *params, char *error);
     @Metrics()
     def MTEConnect(self, params):
+        self._interface = params.get('INTERFACE')
         sParams = '\n'.join(['{0}={1}'.format(str(k), str(v)) for (k,v) in params.items()])
         #self.debug(sParams)
         self._Idx = self._lib.MTEConnect(sParams.encode('utf-8'), self._ErrorMsg)
@@ -192,7 +225,9 @@ class ASTS:
 
     #int32_t MTEDisconnect(int32_t conno);
     def MTEDisconnect(self):
-        return self._lib.MTEDisconnect(self._Idx)
+        _res = self._lib.MTEDisconnect(self._Idx)
+        self._Idx = ASTS.MTE_NOTCONNECTED
+        return _res
 
     #int32_t MTEGetServInfo(int32_t conno, char **buffer, int32_t *len);
     @Metrics()
@@ -245,6 +280,7 @@ class ASTS:
     #@Metrics()
     def MTEStructure(self):
         res = self._lib.MTEStructure(self._Idx, self._mtemsg.pointer())
+        self._record(MTERecorder.FRAME_STRUCTURE, res, _arg=1)
         self._mtemsg.toMTEStructure(res, 1)
         return res
 
@@ -252,6 +288,7 @@ class ASTS:
     #@Metrics()
     def MTEStructure2(self):
         res = self._lib.MTEStructure2(self._Idx, self._mtemsg.pointer())
+        self._record(MTERecorder.FRAME_STRUCTURE, res, _arg=2)
         self._mtemsg.toMTEStructure(res, 2)
         return res
 
@@ -259,23 +296,74 @@ class ASTS:
     #@Metrics()
     def MTEStructureEx(self, _version):
         res = self._lib.MTEStructureEx(self._Idx, _version, self._mtemsg.pointer())
+        self._record(MTERecorder.FRAME_STRUCTURE, res, _arg=_version)
         self._mtemsg.toMTEStructure(res, _version)
         return res
 
+    # Structure from the local cache (CACHEPATH), fetched from the server and re-cached when the cache is stale
+    #@Metrics()
+    def MTEStructureCached(self, _version=2):
+        if self._structCache is None or self._interface is None:
+            return self.MTEStructure2() if _version == 2 else self.MTEStructureEx(_version)
+
+        if self.ServInfo is None and self.MTEGetServInfo() != ASTS.MTE_OK:
+            return self.MTEStructure2() if _version == 2 else self.MTEStructureEx(_version)
+        _serverVersion = (self.ServInfo['Version_Major'], self.ServInfo['Version_Minor'], self.ServInfo['Version_Build'])
+
+        _structure = self._structCache.load(self._interface, _version, _serverVersion)
+        if _structure is not None:
+            self._mtemsg.setMTEStructure(_structure)
+            if self._recorder is not None:
+                self._recorder.recordStructure(_structure)
+            return ASTS.MTE_OK
+
+        _res = self.MTEStructure2() if _version == 2 else self.MTEStructureEx(_version)
+        if _res == ASTS.MTE_OK:
+            self._structCache.save(self._mtemsg.MTEStructure, self._interface, _version, _serverVersion)
+        return _res
+
+    def _tableParams(self, _table, _params):
+        # Params of a table open: a ready string/bytes or a dict of input field values encoded by the schema
+        if isinstance(_params, dict):
+            return self._mtemsg.Schema.encodeParams(_table, _params)
+        return _params if isinstance(_params, bytes) else _params.encode('cp1251')
+
     #int32_t MTEOpenTable(int32_t conno, const char *name, const char *params, int32_t complete, MTEMSG **msg);
     @Metrics()
-    def MTEOpenTable(self, _table, _params, _complete):
+    def MTEOpenTable(self, _table, _params, _complete, columnar=False, lazy=False, fields=None):
         if not self._mtemsg.isMTEStructure():
-            _res = self.MTEStructure2()
+            _res = self.MTEStructureCached()
             if _res != ASTS.MTE_OK:
-                return res
+                return _res
         Metrics.startMetric('lib.MTEOpenTable')
-        _res = self._lib.MTEOpenTable(self._Idx, _table.encode('utf-8'), _params.encode('utf-8'), _complete, self._mtemsg.pointer())
+        _res = self._lib.MTEOpenTable(self._Idx, _table.encode('utf-8'), self._tableParams(_table, _params), _complete, self._mtemsg.pointer())
         Metrics.stopMetric()
-        self._mtemsg.toMTETable(_res, _table)
+        self._record(MTERecorder.FRAME_OPEN, _res, _table)
+        self._mtemsg.toMTETable(_res, _table, columnar, _params=_params, _lazy=lazy, _fields=fields)
 
         return _res
 
+    #int32_t MTEOpenTableAtSnapshot(int32_t conno, const char *name, const char *params, const char *snapshot, int32_t len, MTEMSG **msg);
+    @Metrics()
+    def MTEOpenTableAtSnapshot(self, _table, _params, _snapshot, columnar=False, rows=None, lazy=False, fields=None):
+        # rows - table content saved together with the snapshot, the reply brings only the changes after it
+        if not self._mtemsg.isMTEStructure():
+            _res = self.MTEStructureCached()
+            if _res != ASTS.MTE_OK:
+                return _res
+        Metrics.startMetric('lib.MTEOpenTableAtSnapshot')
+        _res = self._lib.MTEOpenTableAtSnapshot(self._Idx, _table.encode('utf-8'), self._tableParams(_table, _params), _snapshot, len(_snapshot), self._mtemsg.pointer())
+        Metrics.stopMetric()
+        self._record(MTERecorder.FRAME_OPEN, _res, _table)
+        self._mtemsg.toMTETable(_res, _table, columnar, _params=_params, _restore=rows, _lazy=lazy, _fields=fields)
+
+        return _res
+
+    # Open several instances of a table, one per params (dict or string) - e.g. EXT_ORDERBOOK for a few instruments.
+    # Returns MTEOpenTable results; refresh the instances by handle, a table name refers to the last one opened
+    def MTEOpenTables(self, _table, _paramsList, _complete, **kwargs):
+        return [self.MTEOpenTable(_table, p, _complete, **kwargs) for p in _paramsList]
+
     #int32_t MTEAddTable(int32_t conno, int32_t tabno, int32_t ref);
     #@Metrics()
     def MTEAddTable(self, _tabno, _ref=None):
@@ -297,7 +385,17 @@ class ASTS:
         Metrics.stopMetric()
         if _res != self.MTE_OK:
             return _res
+        self._record(MTERecorder.FRAME_REFRESH, _res)
         self._mtemsg.toMTETables(_res)
+        return _res
+
+    def Updated(self):
+        # Handles of the tables delivered by the last MTERefresh
+        return self._mtemsg.Updated
+
+    def setDecodeExecutor(self, _executor, minBytes=65536):
+        # Executor for decoding the table blocks of MTERefresh replies in parallel, None - decode in place
+        self._mtemsg.setExecutor(_executor, minBytes)
 
     #int32_t MTECloseTable(int32_t conno, int32_t tabno);
     @Metrics()
@@ -308,30 +406,65 @@ class ASTS:
         self._mtemsg.closeMTETable(_tabno)
         return self._lib.MTECloseTable(self._Idx, _tabno)
 
-    def TableData(self, _table):
-        return self._mtemsg.TableData(_table)
+    def TableData(self, _table, fields=None):
+        return self._mtemsg.TableData(_table, fields)
+
+    def subscribe(self, _table, _callback, keys=None, fields=None):
+        return self._mtemsg.subscribe(_table, _callback, keys, fields)
+
+    def unsubscribe(self, _sub):
+        self._mtemsg.unsubscribe(_sub)
+
+    def addIndex(self, _table, *_fields):
+        self._mtemsg.addIndex(_table, *_fields)
+
+    def query(self, _table, **_conditions):
+        return self._mtemsg.query(_table, **_conditions)
+
+    def OrderBook(self, _table, _secboard, _seccode):
+        return self._mtemsg.OrderBook(_table, _secboard, _seccode)
 
     #int32_t MTEFreeBuffer(int32_t conno);
     @Metrics()
     def MTEFreeBuffer(self):
         return self._lib.MTEFreeBuffer(self._Idx)
 
-'''
-int32_t MTEExecTransEx(int32_t conno, const char *name, const char *params, int32_t clientIP, MteTransResult *result);
+    #int32_t MTEExecTrans(int32_t conno, const char *name, const char *params, char *error);
+    #int32_t MTEExecTransIP(int32_t conno, const char *name, const char *params, char *error, int32_t clientIP);
+    #@Metrics()
+    def MTEExecTrans(self, _name, _params, _clientIP=None):
+        if isinstance(_params, str):
+            _params = _params.encode('cp1251')
+        if _clientIP is None:
+            res = self._lib.MTEExecTrans(self._Idx, _name.encode('utf-8'), _params, self._ErrorMsg)
+        else:
+            res = self._lib.MTEExecTransIP(self._Idx, _name.encode('utf-8'), _params, self._ErrorMsg, _clientIP)
+        return (res, self.ErrorMsg() if res in ASTS.MTE_TRANSPROCESSED else '')
+
+    #int32_t MTEGetSnapshot(int32_t conno, char **buffer, int32_t *len);
+    @Metrics()
+    def MTEGetSnapshot(self):
+        _buf = POINTER(c_char)()
+        _len = c_int32()
+        res = self._lib.MTEGetSnapshot(self._Idx, byref(_buf), byref(_len))
+        return (res, string_at(_buf, _len.value) if res == ASTS.MTE_OK else None)
 
-int32_t MTEExecTrans(int32_t conno, const char *name, const char *params, char *error);
-int32_t MTEExecTransIP(int32_t conno, const char *name, const char *params, char *error, int32_t clientIP);
+    #int32_t MTESetSnapshot(int32_t conno, const char *buffer, int32_t len, char *error);
+    @Metrics()
+    def MTESetSnapshot(self, _snapshot):
+        res = self._lib.MTESetSnapshot(self._Idx, _snapshot, len(_snapshot), self._ErrorMsg)
+        return (res, self.ErrorMsg() if res != ASTS.MTE_OK else '')
 
-int32_t MTEGetSnapshot(int32_t conno, char **buffer, int32_t *len);
-int32_t MTESetSnapshot(int32_t conno, const char *buffer, int32_t len, char *error);
+'''
+int32_t MTEGetTablesFromSnapshot(int32_t conno, const char* snapshot, int32_t len, MteSnapTable** tables);
+    (not bound: the MteSnapTable layout has to be taken from mtesrl.h)
+
+int32_t MTEExecTransEx(int32_t conno, const char *name, const char *params, int32_t clientIP, MteTransResult *result);
 
 int32_t MTEGetExtData(int32_t conno, const char *DataSetName, const char *ExtFileName, MTEMSG **msg);
 int32_t MTEGetExtDataRange(int32_t conno, const char *DataSetName, const char *ExtFileName,
                                      uint32_t DataOffset, uint32_t DataSize, MTEMSG **msg);
 
-
-int32_t MTEGetTablesFromSnapshot(int32_t conno, const char* snapshot, int32_t len, MteSnapTable** tables);
-int32_t MTEOpenTableAtSnapshot(int32_t conno, const char *name, const char *params, const char *snapshot, int32_t len, MTEMSG **msg);
 '''
 if __name__ == '__main__':
     asts = ASTS(DEBUG=True)
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from asts import ASTS
+
+
+class AsyncASTS:
+    # asyncio front-end for ASTS. Native calls of a connection run one at a time on its own
+    # executor thread, so the event loop never blocks in libmtesrl
+    def __init__(self, LIBPATH=None, DEBUG=False, CACHEPATH=None, asts=None):
+        self.asts = asts if asts is not None else ASTS(LIBPATH=LIBPATH, DEBUG=DEBUG, CACHEPATH=CACHEPATH)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AsyncASTS')
+        self._closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _call(self, _func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(_func, *args, **kwargs))
+
+    async def connect(self, params):
+        return await self._call(self.asts.MTEConnect, params)
+
+    def isConnect(self):
+        return self.asts.isConnect()
+
+    async def disconnect(self):
+        return await self._call(self.asts.MTEDisconnect)
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.asts.isConnect():
+            await self.disconnect()
+        self._executor.shutdown(wait=False)
+
+    async def structure(self, version=2):
+        return await self._call(self.asts.MTEStructureCached, version)
+
+    async def selectBoards(self, boards):
+        return await self._call(self.asts.MTESelectBoards, boards)
+
+    async def openTable(self, table, params='', complete=False, **kwargs):
+        return await self._call(self.asts.MTEOpenTable, table, params, complete, **kwargs)
+
+    async def closeTable(self, table):
+        return await self._call(self.asts.MTECloseTable, table)
+
+    def _refresh(self, _tables):
+        for t in _tables:
+            self.asts.MTEAddTable(t)
+        _res = self.asts.MTERefresh()
+        if _res != ASTS.MTE_OK:
+            return _res, []
+        _updates = []
+        for h in self.asts.Updated():
+            _tb = self.asts.TableData(h)
+            _updates.append({
+                'time': time.time(),
+                'TableName': _tb['TableName'],
+                'HTable': h,
+                # copies: new rows are the stored rows, later refreshes merge into them on the executor thread
+                'rows': [dict(r) for r in _tb['update']],
+            })
+        return _res, _updates
+
+    async def refresh(self, tables=()):
+        # MTEAddTable for the given tables and MTERefresh; returns (result, list of updates)
+        return await self._call(self._refresh, tuple(tables))
+
+    def TableData(self, table):
+        return self.asts.TableData(table)
+
+    async def updates(self, tables, interval=0.2):
+        # async for update in conn.updates(['ORDERS', 'TRADES']): ...
+        while True:
+            _res, _updates = await self.refresh(tables)
+            if _res != ASTS.MTE_OK:
+                raise RuntimeError('MTERefresh ({0:d}): {1:s}'.format(_res, self.asts.MTEErrorMsg(_res)))
+            for u in _updates:
+                yield u
+            if interval:
+                await asyncio.sleep(interval)
@@ -0,0 +1,149 @@
+from collections import deque
+
+
+class BarBuilder:
+    # OHLCV bars of ALL_TRADES built while refreshes arrive: for every instrument (SECBOARD, SECCODE) and every
+    # interval (seconds) there is the current bar and a ring buffer of the last `size` closed bars.
+    # Bar start is in seconds since midnight (TRADETIME). Trades are deduplicated by TRADENO: the last `window`
+    # numbers are remembered, numbers not above the oldest forgotten one count as seen.
+    # A trade older than the current bar of an interval is not applied to it; trades applied to none are counted in `late`
+    FIELDS = ('TRADENO', 'TRADETIME', 'SECBOARD', 'SECCODE', 'PRICE', 'QUANTITY', 'VALUE')
+
+    class Bar:
+        __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume', 'value', 'trades')
+
+        def __init__(self, _start, _price):
+            self.start = _start
+            self.open = self.high = self.low = self.close = _price
+            self.volume = 0
+            self.value = 0.0
+            self.trades = 0
+
+        def __repr__(self):
+            return 'Bar({0}, {1}, {2}, {3}, {4}, {5})'.format(self.start, self.open, self.high, self.low, self.close, self.volume)
+
+        def toDict(self):
+            return {n: getattr(self, n) for n in BarBuilder.Bar.__slots__}
+
+    def __init__(self, intervals=(1, 60), size=1024, window=65536, valueScale=100):
+        # valueScale - 10 ** КолвоДесятичЗнаков of VALUE (ftFixed), feedUpdates takes it from the table fields
+        self.intervals = tuple(intervals)
+        self.size = size
+        self.valueScale = valueScale
+        self.late = 0
+        self.duplicates = 0
+        self._instruments = {}
+        self._window = window
+        self._seen = set()
+        self._order = deque()
+        self._floor = -1
+
+    def _isNew(self, _tradeNo):
+        if _tradeNo <= self._floor or _tradeNo in self._seen:
+            return False
+        self._seen.add(_tradeNo)
+        self._order.append(_tradeNo)
+        if len(self._order) > self._window:
+            _old = self._order.popleft()
+            self._seen.discard(_old)
+            if _old > self._floor:
+                self._floor = _old
+        return True
+
+    @staticmethod
+    def _seconds(_time):
+        return int(_time[0:2]) * 3600 + int(_time[2:4]) * 60 + int(_time[4:6])
+
+    def _series(self, _key):
+        _series = self._instruments.get(_key)
+        if _series is None:
+            _series = self._instruments[_key] = [[None, deque(maxlen=self.size)] for i in self.intervals]
+        return _series
+
+    def add(self, _row):
+        # Returns False for duplicates, late trades and rows without a time or price
+        try:
+            _tradeNo = int(_row['TRADENO'])
+            _time = BarBuilder._seconds(_row['TRADETIME'])
+            _price = float(_row['PRICE'])
+            _quantity = int(_row['QUANTITY'])
+        except (KeyError, ValueError):
+            return False
+        if not self._isNew(_tradeNo):
+            self.duplicates += 1
+            return False
+        try:
+            _value = int(_row['VALUE']) / self.valueScale
+        except (KeyError, ValueError):
+            _value = _price * _quantity
+
+        _series = self._series((_row['SECBOARD'].strip(), _row['SECCODE'].strip()))
+        _applied = False
+        for _interval, _s in zip(self.intervals, _series):
+            _bar = _s[0]
+            _start = _time - _time % _interval
+            if _bar is None and _s[1] and _start <= _s[1][-1].start:
+                continue
+            if _bar is None or _start > _bar.start:
+                if _bar is not None:
+                    _s[1].append(_bar)
+                _bar = _s[0] = BarBuilder.Bar(_start, _price)
+            elif _start < _bar.start:
+                continue
+            if _price > _bar.high:
+                _bar.high = _price
+            elif _price < _bar.low:
+                _bar.low = _price
+            _bar.close = _price
+            _bar.volume += _quantity
+            _bar.value += _value
+            _bar.trades += 1
+            _applied = True
+        if not _applied:
+            self.late += 1
+        return _applied
+
+    def update(self, _rows):
+        _count = 0
+        for r in _rows:
+            if self.add(r):
+                _count += 1
+        return _count
+
+    def feedUpdates(self, _asts, table='ALL_TRADES'):
+        # Feed the rows of the table delivered by the last ASTS.MTERefresh
+        _count = 0
+        for h in _asts.Updated():
+            _tb = _asts.TableData(h)
+            if _tb['TableName'] != table:
+                continue
+            for f in _tb['fields']:
+                if f['name'] == 'VALUE':
+                    self.valueScale = 10 ** (f['dec'] or 0)
+            _count += self.update(_tb['update'])
+        return _count
+
+    def close(self, _time):
+        # Close the current bars whose interval ended by _time (seconds since midnight), e.g. on a timer
+        # for instruments without trades
+        for _series in self._instruments.values():
+            for _interval, _s in zip(self.intervals, _series):
+                if _s[0] is not None and _s[0].start + _interval <= _time:
+                    _s[1].append(_s[0])
+                    _s[0] = None
+
+    def instruments(self):
+        return list(self._instruments.keys())
+
+    def bars(self, _secboard, _seccode, _interval):
+        # Closed bars, oldest first
+        _series = self._instruments.get((_secboard, _seccode))
+        if _series is None:
+            return []
+        return list(_series[self.intervals.index(_interval)][1])
+
+    def current(self, _secboard, _seccode, _interval):
+        _series = self._instruments.get((_secboard, _seccode))
+        if _series is None:
+            return None
+        return _series[self.intervals.index(_interval)][0]
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import time
+import tracemalloc
+import mtemsg
+from metrics import Metrics
+
+
+class MTEMSGGenerator:
+    # Builds MTEMSG reply blocks (DataLen and Data) in the wire format read by MTEMSG from MTEStructure.json:
+    # the structure itself (version 2), MTEOpenTable replies and multi-table MTERefresh replies
+    def __init__(self, _structure, seed=0):
+        self.structure = _structure
+        self.tables = {t['Имя']: t for t in _structure['Таблицы']}
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def _string(_value):
+        _value = (_value or '').encode('cp1251')
+        return struct.pack('<I', len(_value)) + _value
+
+    @staticmethod
+    def _integer(_value):
+        return struct.pack('<I', _value or 0)
+
+    @staticmethod
+    def _flags(_names, _flags):
+        return MTEMSGGenerator._integer(sum(k for (k, v) in _flags.items() if v in _names))
+
+    @staticmethod
+    def _field(_fld, _isInput):
+        _s, _i = MTEMSGGenerator._string, MTEMSGGenerator._integer
+        _res = _s(_fld['Имя']) + _s(_fld['Заголовок']) + _s(_fld['Описание']) + _i(_fld['Размер']) \
+            + _i(mtemsg.MTEMSG.FIELD_TYPE.index(_fld['Тип'])) + _i(_fld['КолвоДесятичЗнаков']) \
+            + MTEMSGGenerator._flags(_fld['Атрибуты'], mtemsg.MTEMSG.FIELD_FLAGS) + _s(_fld['ПеречислимыйТип'])
+        if _isInput:
+            _res += _s(_fld['ЗначениеПоУмолчанию'])
+        return _res
+
+    @staticmethod
+    def _fields(_flds, _isInput):
+        return MTEMSGGenerator._integer(len(_flds)) + b''.join(MTEMSGGenerator._field(f, _isInput) for f in _flds)
+
+    @staticmethod
+    def block(_data):
+        return struct.pack('<i', len(_data)) + _data
+
+    def structureMsg(self):
+        _s, _i = MTEMSGGenerator._string, MTEMSGGenerator._integer
+        _st = self.structure
+        _res = _s(_st['ИмяИнтерфейса']) + _s(_st['ЗаголовокИнтерфейса']) + _s(_st['ОписаниеИнтерфейса'])
+        _res += _i(len(_st['ПеречислимыеТипы']))
+        for e in _st['ПеречислимыеТипы']:
+            _res += _s(e['Имя']) + _s(e['Заголовок']) + _s(e['Описание']) + _i(e['Размер']) \
+                + _i(mtemsg.MTEMSG.ENUM_KIND.index(e['Тип'])) + _i(len(e['Константа']))
+            for c in e['Константа']:
+                _res += _s(c['Значение']) + _s(c['ДлинноеОписание']) + _s(c['КраткоеОписание'])
+        _res += _i(len(_st['Таблицы']))
+        for t in _st['Таблицы']:
+            _res += _s(t['Имя']) + _s(t['Заголовок']) + _s(t['Описание']) + _i(t['ИндексСистемы']) \
+                + MTEMSGGenerator._flags(t['Атрибуты'], mtemsg.MTEMSG.TABLE_FLAGS) \
+                + MTEMSGGenerator._fields(t['ВходныеПоля'], True) + MTEMSGGenerator._fields(t['ВыходныеПоля'], False)
+        _res += _i(len(_st['Транзакции']))
+        for t in _st['Транзакции']:
+            _res += _s(t['Имя']) + _s(t['Заголовок']) + _s(t['Описание']) + _i(t['ИндексСистемы']) \
+                + MTEMSGGenerator._fields(t['ВходныеПоля'], True)
+        return MTEMSGGenerator.block(_res)
+
+    # Rows of an order book per instrument
+    BOOK_DEPTH = 20
+
+    def value(self, _fld, _rowNo, _book=False):
+        _size = _fld['Размер']
+        if _fld['Имя'] == 'BUYSELL':
+            return 'BS'[_rowNo % 2].encode()[:_size].ljust(_size, b' ')
+        if _fld['Имя'] == 'PRICE':
+            return '{0:.2f}'.format(100 + (_rowNo % MTEMSGGenerator.BOOK_DEPTH) * 0.01).encode()[:_size].ljust(_size, b' ')
+        if _fld['Тип'] == 'ftChar':
+            if _fld['Имя'] == 'SECBOARD':
+                _val = 'TQBR'
+            elif _fld['Имя'] == 'SECCODE' and _book:
+                _val = 'S{0:d}'.format(_rowNo // MTEMSGGenerator.BOOK_DEPTH)
+            elif 'ffKey' in _fld['Атрибуты'] or _fld['Имя'] == 'SECCODE':
+                _val = 'K{0:d}'.format(_rowNo)
+            else:
+                _val = ''.join(self._random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ') for i in range(self._random.randint(0, _size)))
+            return _val.encode('cp1251')[:_size].ljust(_size, b' ')
+        if _fld['Тип'] == 'ftDate':
+            return b'20201218'[:_size].ljust(_size, b' ')
+        if _fld['Тип'] == 'ftTime':
+            return '{0:02d}{1:02d}{2:02d}'.format(10 + _rowNo // 3600 % 8, _rowNo // 60 % 60, _rowNo % 60).encode()[:_size].ljust(_size, b' ')
+        _val = _rowNo if 'ffKey' in _fld['Атрибуты'] else self._random.randint(0, 10 ** min(_size, 12) - 1)
+        return str(_val).encode()[-_size:].rjust(_size, b'0')
+
+    def row(self, _table, _rowNo, _partial=0.0):
+        # _partial - share of non-key fields in a partial row (field-number vector); 0 - full row
+        _flds = self.tables[_table]['ВыходныеПоля']
+        _book = 'tfOrderbook' in self.tables[_table]['Атрибуты']
+        if not _partial:
+            _data = b''.join(self.value(f, _rowNo, _book) for f in _flds)
+            return struct.pack('<BI', 0, len(_data)) + _data
+
+        _numbers = [i for (i, f) in enumerate(_flds) if 'ffKey' in f['Атрибуты'] or self._random.random() < _partial]
+        _data = b''.join(self.value(_flds[i], _rowNo, _book) for i in _numbers)
+        return struct.pack('<BI', len(_numbers), len(_data)) + bytes(_numbers) + _data
+
+    def rows(self, _table, _count, _partial=0.0, _first=0):
+        return MTEMSGGenerator._integer(_count) + b''.join(self.row(_table, _first + i, _partial) for i in range(_count))
+
+    def tableMsg(self, _table, _count, _ref=1, _partial=0.0):
+        return MTEMSGGenerator.block(MTEMSGGenerator._integer(_ref) + self.rows(_table, _count, _partial))
+
+    def tablesMsg(self, _tables):
+        # _tables - list of (HTable, table name, rows, partial)
+        _res = MTEMSGGenerator._integer(len(_tables))
+        for (h, t, c, p) in _tables:
+            _res += MTEMSGGenerator._integer(h) + self.rows(t, c, p)
+        return MTEMSGGenerator.block(_res)
+
+
+class Benchmark:
+    # Throughput of MTEMSG.toMTEStructure/toMTETable/toMTETables over synthetic replies
+    TABLES = (
+        # table, rows in MTEOpenTable, rows in MTERefresh, share of fields in a partial row
+        ('SECURITIES', 3000, 1000, 0.1),
+        ('ORDERS', 5000, 500, 0.2),
+        ('TRADES', 5000, 500, 0.0),
+        ('EXT_ORDERBOOK', 2000, 2000, 0.0),
+    )
+
+    def __init__(self, structureFile, scale=1.0, repeat=5, seed=0):
+        with open(structureFile, 'r') as fp:
+            _structure = json.load(fp)
+        self._generator = MTEMSGGenerator(_structure, seed)
+        self._scale = scale
+        self._repeat = repeat
+        self.results = {}
+
+    def _msg(self):
+        _msg = mtemsg.MTEMSG()
+        _msg.setData(self._structureMsg)
+        _msg.toMTEStructure(mtemsg.ASTS.MTE_OK, 2)
+        return _msg
+
+    def _measure(self, _name, _data, _rows, _prepare, _run):
+        _times = []
+        for i in range(self._repeat):
+            _msg = _prepare()
+            _msg.setData(_data)
+            _start = time.perf_counter()
+            _run(_msg)
+            _times.append(time.perf_counter() - _start)
+
+        _msg = _prepare()
+        _msg.setData(_data)
+        tracemalloc.start()
+        _run(_msg)
+        _current, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        _best = min(_times)
+        self.results[_name] = {
+            'bytes': len(_data),
+            'rows': _rows,
+            'seconds': _best,
+            'MB/s': len(_data) / _best / 1e6,
+            'rows/s': _rows / _best if _rows else None,
+            'allocated': _current,
+            'peak': _peak,
+        }
+
+    def run(self):
+        Metrics.noPrint = True
+        _gen = self._generator
+        self._structureMsg = _gen.structureMsg()
+        self._measure('toMTEStructure', self._structureMsg, 0, mtemsg.MTEMSG,
+                      lambda m: m.toMTEStructure(mtemsg.ASTS.MTE_OK, 2))
+
+        _handles = []
+        for (h, (t, _open, _refresh, _partial)) in enumerate(Benchmark.TABLES, 1):
+            _open = int(_open * self._scale)
+            _refresh = int(_refresh * self._scale)
+            self._measure('toMTETable.{0:s}'.format(t), _gen.tableMsg(t, _open, h), _open, self._msg,
+                          lambda m, t=t, h=h: m.toMTETable(h, t))
+
+            _opened = _gen.tableMsg(t, _open, h)
+
+            def _prepare(t=t, h=h, _opened=_opened):
+                _msg = self._msg()
+                _msg.setData(_opened)
+                _msg.toMTETable(h, t)
+                return _msg
+            for (_kind, _p) in (('full', 0.0), ('partial', _partial)):
+                if _kind == 'partial' and not _p:
+                    continue
+                self._measure('toMTETables.{0:s}.{1:s}'.format(t, _kind), _gen.tablesMsg([(h, t, _refresh, _p)]),
+                              _refresh, _prepare, lambda m: m.toMTETables(mtemsg.ASTS.MTE_OK))
+            _handles.append((h, t, _refresh, _partial))
+
+        def _prepareAll():
+            _msg = self._msg()
+            for (h, t, c, p) in _handles:
+                _msg.setData(_gen.tableMsg(t, 1, h))
+                _msg.toMTETable(h, t)
+            return _msg
+        self._measure('toMTETables.all', _gen.tablesMsg(_handles), sum(c for (h, t, c, p) in _handles),
+                      _prepareAll, lambda m: m.toMTETables(mtemsg.ASTS.MTE_OK))
+        return self.results
+
+    def print(self, file=sys.stdout):
+        print('{0:<36s} {1:>11s} {2:>8s} {3:>10s} {4:>12s} {5:>12s}'.format('Case', 'Bytes', 'MB/s', 'Rows/s', 'Allocated', 'Peak'), file=file)
+        for n, r in self.results.items():
+            print('{0:<36s} {1:>11,d} {2:>8.2f} {3:>10s} {4:>12,d} {5:>12,d}'.format(
+                n, r['bytes'], r['MB/s'], '{0:,.0f}'.format(r['rows/s']) if r['rows/s'] else '-', r['allocated'], r['peak']), file=file)
+
+    def save(self, fileName):
+        with open(fileName, 'w') as fp:
+            json.dump(self.results, fp, indent=4)
+
+    def compare(self, fileName, tolerance=0.1, file=sys.stdout):
+        # Returns the cases whose throughput fell below the baseline by more than tolerance
+        with open(fileName, 'r') as fp:
+            _baseline = json.load(fp)
+        _regressions = []
+        for n, r in self.results.items():
+            if n not in _baseline:
+                continue
+            _ratio = r['MB/s'] / _baseline[n]['MB/s']
+            print('{0:<36s} {1:>8.2f} -> {2:>8.2f} MB/s ({3:+.1%})'.format(n, _baseline[n]['MB/s'], r['MB/s'], _ratio - 1), file=file)
+            if _ratio < 1 - tolerance:
+                _regressions.append(n)
+        return _regressions
+
+
+if __name__ == '__main__':
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='MTEMSG parser benchmark on synthetic replies')
+    parser.add_argument('--structure', default=os.path.join(_dir, 'MTEStructure.json'))
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of the row counts')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    bench = Benchmark(args.structure, scale=args.scale, repeat=args.repeat)
+    bench.run()
+    bench.print()
+    if args.save:
+        bench.save(args.save)
+    if args.compare:
+        regressions = bench.compare(args.compare, args.tolerance)
+        if regressions:
+            print('Regressions: ' + ', '.join(regressions))
+            exit(1)
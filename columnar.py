@@ -0,0 +1,136 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from schema import Schema
+
+
+class ColumnTable:
+    # Columnar content of an opened table: one NumPy array per output field.
+    # ftChar/ftDate/ftTime columns are fixed-width cp1251 byte strings, ftInteger - int64,
+    # ftFixed - float64 scaled by КолвоДесятичЗнаков, ftFloat/ftFloatPoint - float64 as received.
+    # Rows are addressed by position; the ffKey index maps key values to positions
+    def __init__(self, _flds, _flags=(), _capacity=1024):
+        if np is None:
+            raise ImportError('numpy is required for columnar tables')
+        self.fields = {f['name']: f for f in _flds}
+        self.keys = tuple(f['name'] for f in _flds if f['key'])
+        self.clearOnUpdate = 'tfClearOnUpdate' in _flags
+        self._capacity = _capacity
+        self._count = 0
+        self._index = {}
+        self._columns = {}
+        self._convert = {}
+        for f in _flds:
+            _conv = Schema.numericConverter(f)
+            if _conv is None:
+                _dtype, _conv = 'S%d' % f['size'], ColumnTable._toBytes
+            elif f['type'] == 'ftInteger':
+                _dtype = np.int64
+            else:
+                _dtype = np.float64
+            self._columns[f['name']] = np.zeros(_capacity, dtype=_dtype)
+            self._convert[f['name']] = _conv
+
+    @staticmethod
+    def _toBytes(_value):
+        return _value.encode('cp1251')
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self.row(i)
+
+    def row(self, _pos):
+        _row = {}
+        for n, c in self._columns.items():
+            v = c[_pos]
+            _row[n] = v.decode('cp1251') if isinstance(v, bytes) else v.item()
+        return _row
+
+    def column(self, _name):
+        return self._columns[_name][:self._count]
+
+    def clear(self):
+        self._count = 0
+        self._index.clear()
+
+    def _grow(self):
+        self._capacity *= 2
+        for n, c in self._columns.items():
+            _new = np.zeros(self._capacity, dtype=c.dtype)
+            _new[:self._count] = c[:self._count]
+            self._columns[n] = _new
+
+    def _rowKey(self, _row):
+        if not self.keys:
+            return None
+        try:
+            return tuple([_row[k] for k in self.keys])
+        except KeyError:
+            return None
+
+    def update(self, _rows):
+        if self.clearOnUpdate:
+            self.clear()
+
+        _columns = self._columns
+        _convert = self._convert
+        for _row in _rows:
+            _key = self._rowKey(_row)
+            _pos = self._index.get(_key) if _key is not None else None
+            if _pos is None:
+                if self._count == self._capacity:
+                    self._grow()
+                    _columns = self._columns
+                _pos = self._count
+                self._count += 1
+                for c in _columns.values():
+                    c[_pos] = c.dtype.type()
+                if _key is not None:
+                    self._index[_key] = _pos
+            for n, v in _row.items():
+                _columns[n][_pos] = _convert[n](v)
+
+    def _value(self, _name, _value):
+        # Char columns are compared with values padded to the field size, as they come from MTE
+        if self._columns[_name].dtype.kind == 'S' and isinstance(_value, str):
+            return _value.encode('cp1251').ljust(self.fields[_name]['size'])
+        return _value
+
+    def mask(self, **_conditions):
+        # Field=value equality, field=(lo, hi) inclusive range, field=[v1, v2, ...] membership
+        _mask = np.ones(self._count, dtype=bool)
+        for n, v in _conditions.items():
+            c = self.column(n)
+            if isinstance(v, tuple):
+                _lo, _hi = v
+                if _lo is not None:
+                    _mask &= c >= self._value(n, _lo)
+                if _hi is not None:
+                    _mask &= c <= self._value(n, _hi)
+            elif isinstance(v, (list, set, frozenset)):
+                _mask &= np.isin(c, [self._value(n, x) for x in v])
+            else:
+                _mask &= c == self._value(n, v)
+        return _mask
+
+    def where(self, **_conditions):
+        return np.flatnonzero(self.mask(**_conditions))
+
+    def sort(self, _name, _positions=None, reverse=False):
+        if _positions is None:
+            _positions = np.arange(self._count)
+        _order = np.argsort(self._columns[_name][_positions], kind='stable')
+        if reverse:
+            _order = _order[::-1]
+        return _positions[_order]
+
+    def select(self, _names=None, _positions=None):
+        if _names is None:
+            _names = self._columns.keys()
+        if _positions is None:
+            return {n: self.column(n) for n in _names}
+        return {n: self._columns[n][_positions] for n in _names}
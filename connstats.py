@@ -0,0 +1,92 @@
+import threading
+import time
+from collections import deque
+from asts import ASTS
+
+
+class ConnStatsSampler:
+    # Samples ASTS.MTEConnectionStats in the background and turns the session counters into rates.
+    # Every sample is a dict: time, seconds since the previous sample, <counter>/s rates,
+    # recvCompression/sentCompression (uncompressed / wire bytes), reconnects and the raw counters.
+    # Samples are kept in a ring buffer of `size` entries.
+    # `call` runs a function on the thread owning the connection, e.g. lambda f: scheduler.call(f).result()
+    COUNTERS = ('SentPackets', 'RecvPackets', 'SentBytes', 'RecvBytes', 'SentUncompressed', 'RecvUncompressed',
+                'ReconnectCount', 'TsmrSent', 'TsmrRecv')
+
+    def __init__(self, _asts, interval=1.0, size=3600, call=None):
+        self._asts = _asts
+        self.interval = interval
+        self._call = call if call is not None else (lambda f: f())
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._prev = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read(self):
+        _res = self._asts.MTEConnectionStats()
+        if _res != ASTS.MTE_OK:
+            return None
+        _stats = self._asts.ConnStats
+        return {n: getattr(_stats, n) for n in ConnStatsSampler.COUNTERS}
+
+    def sample(self):
+        _counters = self._call(self._read)
+        _now = time.monotonic()
+        if _counters is None:
+            return None
+
+        _sample = {'time': time.time(), 'counters': _counters}
+        if self._prev is not None:
+            _prevTime, _prevCounters = self._prev
+            _dt = _now - _prevTime
+            # Counters are uint32 and wrap around
+            _delta = {n: (_counters[n] - _prevCounters[n]) & 0xFFFFFFFF for n in ConnStatsSampler.COUNTERS}
+            _sample['seconds'] = _dt
+            for n in ConnStatsSampler.COUNTERS:
+                _sample[n + '/s'] = _delta[n] / _dt if _dt > 0 else 0.0
+            _sample['recvCompression'] = _delta['RecvUncompressed'] / _delta['RecvBytes'] if _delta['RecvBytes'] else None
+            _sample['sentCompression'] = _delta['SentUncompressed'] / _delta['SentBytes'] if _delta['SentBytes'] else None
+            _sample['reconnects'] = _delta['ReconnectCount']
+        self._prev = (_now, _counters)
+
+        with self._lock:
+            self._samples.append(_sample)
+        return _sample
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='ConnStatsSampler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def samples(self, since=None):
+        # Samples with time >= since (time.time()), all of them when since is None
+        with self._lock:
+            return [s for s in self._samples if since is None or s['time'] >= since]
+
+    def latest(self):
+        with self._lock:
+            return self._samples[-1] if self._samples else None
+
+    def average(self, _field, window=None):
+        # Mean of a rate field ('RecvBytes/s', 'recvCompression', ...) over the last `window` seconds
+        _since = time.time() - window if window is not None else None
+        _values = [s[_field] for s in self.samples(_since) if s.get(_field) is not None]
+        return sum(_values) / len(_values) if _values else None
+
+    def reconnects(self, since=None):
+        return [s for s in self.samples(since) if s.get('reconnects')]
@@ -0,0 +1,244 @@
+import marshal
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_right
+from hashlib import blake2b
+
+
+class Journal:
+    # Append-only binary journal of decoded table updates.
+    # <name>.jnl - records: RECORD header (type, time ns, table id, payload length) and the payload.
+    #   REC_TABLE payload - marshal of (table name, key field names), REC_ROWS payload - marshal of the list of rows.
+    # <name>.idx - sparse index: IDX_TABLE entries repeat the table definitions, IDX_BLOCK entries are written
+    #   every `indexEvery` records and hold the time and offset of the block start and 64-bit hashes
+    #   of the row keys found in the block
+    MAGIC = b'MTEJNL\x01\x00'
+    RECORD = struct.Struct('<BqHI')
+    REC_TABLE = 0
+    REC_ROWS = 1
+
+    IDX_ENTRY = struct.Struct('<BqQI')
+    IDX_TABLE = 0
+    IDX_BLOCK = 1
+    HASH = struct.Struct('<Q')
+
+    @staticmethod
+    def keyHash(_table, _key):
+        return Journal.HASH.unpack(blake2b(repr((_table, ) + tuple(v.strip() for v in _key)).encode('utf-8'), digest_size=8).digest())[0]
+
+
+class JournalWriter:
+    def __init__(self, _fileName, indexEvery=256):
+        self.fileName = _fileName
+        self.indexEvery = indexEvery
+        self._data = open(_fileName + '.jnl', 'ab')
+        self._index = open(_fileName + '.idx', 'ab')
+        if self._data.tell() == 0:
+            self._data.write(Journal.MAGIC)
+        self._tables = {}
+        self._blockStart = None
+        self._blockCount = 0
+        self._blockKeys = set()
+        if self._data.tell() > len(Journal.MAGIC):
+            self._loadTables()
+
+    def _loadTables(self):
+        # Continue an existing journal: table ids come from its index
+        _reader = JournalReader(self.fileName)
+        self._tables = {t: (i, k) for (i, (t, k)) in _reader.tables.items()}
+        _reader.close()
+
+    def _write(self, _type, _time, _tableId, _payload):
+        _offset = self._data.tell()
+        self._data.write(Journal.RECORD.pack(_type, _time, _tableId, len(_payload)))
+        self._data.write(_payload)
+        return _offset
+
+    def _table(self, _table, _keys):
+        _def = self._tables.get(_table)
+        if _def is None:
+            _def = self._tables[_table] = (len(self._tables), tuple(_keys))
+            _payload = marshal.dumps((_table, tuple(_keys)))
+            _time = time.time_ns()
+            self._write(Journal.REC_TABLE, _time, _def[0], _payload)
+            self._index.write(Journal.IDX_ENTRY.pack(Journal.IDX_TABLE, _time, _def[0], len(_payload)))
+            self._index.write(_payload)
+            self._index.flush()
+        return _def
+
+    def append(self, _table, _rows, keys=(), _time=None):
+        # keys - names of the fields forming the row key of the table (ffKey fields), used by the key index
+        if not _rows:
+            return
+        _tableId, _keys = self._table(_table, keys)
+        _time = _time if _time is not None else time.time_ns()
+        _offset = self._write(Journal.REC_ROWS, _time, _tableId, marshal.dumps([dict(r) for r in _rows]))
+        if self._blockStart is None:
+            self._blockStart = (_time, _offset)
+        if _keys:
+            for r in _rows:
+                try:
+                    self._blockKeys.add(Journal.keyHash(_table, [r[k] for k in _keys]))
+                except KeyError:
+                    pass
+        self._blockCount += 1
+        if self._blockCount >= self.indexEvery:
+            self._seal()
+
+    def appendUpdates(self, _asts, tables=None):
+        # Journal the rows delivered by the last ASTS.MTERefresh
+        for h in _asts.Updated():
+            _tb = _asts.TableData(h)
+            if tables is None or _tb['TableName'] in tables:
+                self.append(_tb['TableName'], _tb['update'], keys=_tb['rows'].keys)
+
+    def _seal(self):
+        if self._blockStart is None:
+            return
+        self._data.flush()
+        self._index.write(Journal.IDX_ENTRY.pack(Journal.IDX_BLOCK, self._blockStart[0], self._blockStart[1], len(self._blockKeys)))
+        self._index.write(b''.join(Journal.HASH.pack(h) for h in sorted(self._blockKeys)))
+        self._index.flush()
+        self._blockStart = None
+        self._blockCount = 0
+        self._blockKeys = set()
+
+    def flush(self):
+        self._seal()
+        self._data.flush()
+
+    def close(self):
+        self.flush()
+        self._data.close()
+        self._index.close()
+
+
+class JournalReader:
+    # Reads a journal through mmap. records() yields (time, table, payload) where payload is a memoryview
+    # into the mapping; rows(payload) decodes it. The index narrows scans by time and by key
+    def __init__(self, _fileName):
+        self.fileName = _fileName
+        self.tables = {}
+        self._blocks = []
+        self._blockTimes = []
+        self._keys = {}
+        self._fp = open(_fileName + '.jnl', 'rb')
+        self._map = None
+        self._view = None
+        self.reload()
+
+    def reload(self):
+        # Map the current size of the journal and reread the index (the writer may still be appending)
+        self._release()
+        _size = os.fstat(self._fp.fileno()).st_size
+        if _size > 0:
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+            if self._view[:len(Journal.MAGIC)] != Journal.MAGIC:
+                raise ValueError('{0:s} is not a journal'.format(self.fileName))
+        self._size = _size
+        self._loadIndex()
+
+    def _loadIndex(self):
+        self.tables = {}
+        self._blocks = []
+        self._keys = {}
+        try:
+            with open(self.fileName + '.idx', 'rb') as fp:
+                _index = fp.read()
+        except OSError:
+            _index = b''
+        _pos = 0
+        while _pos + Journal.IDX_ENTRY.size <= len(_index):
+            _type, _time, _value, _count = Journal.IDX_ENTRY.unpack_from(_index, _pos)
+            _pos += Journal.IDX_ENTRY.size
+            if _type == Journal.IDX_TABLE:
+                if _pos + _count > len(_index):
+                    break
+                self.tables[_value] = marshal.loads(_index[_pos:_pos + _count])
+                _pos += _count
+            else:
+                if _pos + _count * Journal.HASH.size > len(_index):
+                    break
+                _block = len(self._blocks)
+                self._blocks.append((_time, _value))
+                for i in range(_count):
+                    self._keys.setdefault(Journal.HASH.unpack_from(_index, _pos)[0], []).append(_block)
+                    _pos += Journal.HASH.size
+        self._blockTimes = [b[0] for b in self._blocks]
+
+    def _release(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def close(self):
+        self._release()
+        self._fp.close()
+
+    @staticmethod
+    def rows(_payload):
+        return marshal.loads(_payload)
+
+    def _scan(self, _offset, _end=None):
+        _view = self._view
+        _size = self._size if _end is None else min(_end, self._size)
+        while _offset + Journal.RECORD.size <= _size:
+            _type, _time, _tableId, _len = Journal.RECORD.unpack_from(_view, _offset)
+            _offset += Journal.RECORD.size
+            if _offset + _len > self._size:
+                return
+            if _type == Journal.REC_TABLE:
+                if _tableId not in self.tables:
+                    self.tables[_tableId] = marshal.loads(_view[_offset:_offset + _len])
+            else:
+                yield _time, _tableId, _view[_offset:_offset + _len]
+            _offset += _len
+
+    def _tail(self):
+        # Records after the last indexed block start
+        return self._blocks[-1][1] if self._blocks else len(Journal.MAGIC)
+
+    def records(self, start=None, end=None, tables=None):
+        # start/end - time ns (inclusive/exclusive); tables - names of the tables
+        if self._view is None:
+            return
+        _offset = len(Journal.MAGIC)
+        if start is not None and self._blocks:
+            _block = bisect_right(self._blockTimes, start) - 1
+            if _block > 0:
+                _offset = self._blocks[_block][1]
+        for _time, _tableId, _payload in self._scan(_offset):
+            if start is not None and _time < start:
+                continue
+            if end is not None and _time >= end:
+                return
+            _table = self.tables[_tableId][0]
+            if tables is None or _table in tables:
+                yield _time, _table, _payload
+
+    def history(self, _table, _key, start=None, end=None):
+        # Rows of one key of a table, in journal order: yields (time, row)
+        if self._view is None:
+            return
+        _hash = Journal.keyHash(_table, _key)
+        _key = tuple(v.strip() for v in _key)
+        _ranges = [(self._blocks[b][1], self._blocks[b + 1][1] if b + 1 < len(self._blocks) else None)
+                   for b in self._keys.get(_hash, [])]
+        if not self._blocks or _ranges[-1:] != [(self._blocks[-1][1], None)]:
+            _ranges.append((self._tail(), None))
+        for _begin, _end in _ranges:
+            for _time, _tableId, _payload in self._scan(_begin, _end):
+                _name, _keys = self.tables[_tableId]
+                if _name != _table or not _keys:
+                    continue
+                if (start is not None and _time < start) or (end is not None and _time >= end):
+                    continue
+                for r in marshal.loads(_payload):
+                    if tuple(r.get(k, '').strip() for k in _keys) == _key:
+                        yield _time, r
@@ -1,12 +1,61 @@
 from functools import wraps
 from time import time_ns
+import json
+import threading
 
 
 class Metrics:
-    _QUEUE = []
     Var = {}
     VAR_LE = 'LastExecute'
     noPrint = False
+    # False - decorated functions are called directly and start/stopMetric do nothing
+    enabled = True
+
+    _local = threading.local()
+    _lock = threading.Lock()
+    _histograms = {}
+    _bytes = {}
+
+    class Histogram:
+        # Call durations in log2 buckets: bucket i counts durations in [2^(i-1), 2^i) ns
+        BUCKETS = 48
+        __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+        def __init__(self):
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+            self.buckets = [0] * Metrics.Histogram.BUCKETS
+
+        def add(self, _ns):
+            self.count += 1
+            self.total += _ns
+            if self.min is None or _ns < self.min:
+                self.min = _ns
+            if _ns > self.max:
+                self.max = _ns
+            self.buckets[min(_ns.bit_length(), Metrics.Histogram.BUCKETS - 1)] += 1
+
+        def quantile(self, _q):
+            _rank = _q * self.count
+            _seen = 0
+            for i, c in enumerate(self.buckets):
+                _seen += c
+                if c and _seen >= _rank:
+                    return min(1 << i, self.max)
+            return self.max
+
+        def toDict(self):
+            return {
+                'count': self.count,
+                'total_ns': self.total,
+                'min_ns': self.min,
+                'max_ns': self.max,
+                'p50_ns': self.quantile(0.5),
+                'p99_ns': self.quantile(0.99),
+                'buckets': {1 << i: c for i, c in enumerate(self.buckets) if c},
+            }
 
     def __init__(self, skepSelf=True, showArgs=True, timeSize='ms', noPrint=False, *args, **kwargs):
         self._skepSelf = skepSelf
@@ -16,42 +65,117 @@ class Metrics:
         pass
 
     def __call__(self, func):
+        _name = func.__name__
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            _qLen = len(self._QUEUE)
-            self.startMetric(func.__name__, *((args[1:] if self._skepSelf else args) if self._showArgs else ()))
-            result = func(*args, **kwargs)
-            for _ in range(_qLen, len(self._QUEUE)):
-                self.stopMetric(timeSize=self._timeSize)
-            return result
+            if not Metrics.enabled:
+                return func(*args, **kwargs)
+            _queue = Metrics._queue()
+            _qLen = len(_queue)
+            if Metrics.noPrint or self.noPrint or not self._showArgs:
+                self.startMetric(_name)
+            else:
+                self.startMetric(_name, *(args[1:] if self._skepSelf else args))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                for _ in range(_qLen, len(_queue)):
+                    self.stopMetric(timeSize=self._timeSize)
 
         return wrapper
 
+    @staticmethod
+    def _queue():
+        # Nesting of started metrics is kept per thread
+        try:
+            return Metrics._local.queue
+        except AttributeError:
+            Metrics._local.queue = []
+            return Metrics._local.queue
+
     @staticmethod
     def startMetric(_name, *args):
-        # arg = ('%s%s' %(_name, ', '.join(map(str, args))), time_ns())
-        # print('%s Start: %s %s' % ('>>' * (len(Metrics._QUEUE) + 1), _name, ', '.join(map(str, args))) )
+        if not Metrics.enabled:
+            return
+        _queue = Metrics._queue()
         if Metrics.noPrint == False:
-            print('%s Start: %s%s' % ('>>' * (len(Metrics._QUEUE) + 1), _name, str(args)))
-        Metrics._QUEUE.append((_name, time_ns()))
+            print('%s Start: %s%s' % ('>>' * (len(_queue) + 1), _name, str(args)))
+        _queue.append((_name, time_ns()))
 
     @staticmethod
     def stopMetric(timeSize='ms', *args):
-        arg = Metrics._QUEUE.pop()
-        te = Metrics._time_execute(timeBegin=arg[1], timeSize=timeSize)
+        _queue = Metrics._queue()
+        if not _queue:
+            return
+        arg = _queue.pop()
+        _te = time_ns() - arg[1]
+        Metrics.Var[Metrics.VAR_LE] = _te
+        with Metrics._lock:
+            _hist = Metrics._histograms.get(arg[0])
+            if _hist is None:
+                _hist = Metrics._histograms[arg[0]] = Metrics.Histogram()
+            _hist.add(_te)
         if Metrics.noPrint == False:
             print('%s Stop: %s. Time: %s. %s' % (
-                    '>>' * (len(Metrics._QUEUE) + 1),
+                    '>>' * (len(_queue) + 1),
                     arg[0],
-                    te,
+                    Metrics._time_execute(timeBegin=arg[1], timeEnd=arg[1] + _te, timeSize=timeSize),
                     '. '.join(args)
                 )
             )
 
+    @staticmethod
+    def addBytes(_name, _count):
+        if not Metrics.enabled:
+            return
+        with Metrics._lock:
+            Metrics._bytes[_name] = Metrics._bytes.get(_name, 0) + _count
+
     @staticmethod
     def info(*args):
         if Metrics.noPrint == False:
-            print('%s Info: %s' % ('==' * (len(Metrics._QUEUE)), ', '.join(map(str, args))))
+            print('%s Info: %s' % ('==' * (len(Metrics._queue())), ', '.join(map(str, args))))
+
+    @staticmethod
+    def reset():
+        with Metrics._lock:
+            Metrics._histograms = {}
+            Metrics._bytes = {}
+
+    @staticmethod
+    def snapshot():
+        with Metrics._lock:
+            return {
+                'time_ns': time_ns(),
+                'calls': {n: h.toDict() for n, h in Metrics._histograms.items()},
+                'bytes': dict(Metrics._bytes),
+            }
+
+    @staticmethod
+    def toJSON(indent=None):
+        return json.dumps(Metrics.snapshot(), indent=indent)
+
+    @staticmethod
+    def toPrometheus(prefix='moex'):
+        _snap = Metrics.snapshot()
+        _lines = [
+            '# HELP {0:s}_call_duration_seconds Duration of measured calls'.format(prefix),
+            '# TYPE {0:s}_call_duration_seconds histogram'.format(prefix),
+        ]
+        for n, h in _snap['calls'].items():
+            _cumulative = 0
+            for _le, c in sorted(h['buckets'].items()):
+                _cumulative += c
+                _lines.append('{0:s}_call_duration_seconds_bucket{{name="{1:s}",le="{2:.9g}"}} {3:d}'.format(prefix, n, _le / 1e9, _cumulative))
+            _lines.append('{0:s}_call_duration_seconds_bucket{{name="{1:s}",le="+Inf"}} {2:d}'.format(prefix, n, h['count']))
+            _lines.append('{0:s}_call_duration_seconds_sum{{name="{1:s}"}} {2:.9g}'.format(prefix, n, h['total_ns'] / 1e9))
+            _lines.append('{0:s}_call_duration_seconds_count{{name="{1:s}"}} {2:d}'.format(prefix, n, h['count']))
+        _lines.append('# HELP {0:s}_bytes_total Bytes counted by name'.format(prefix))
+        _lines.append('# TYPE {0:s}_bytes_total counter'.format(prefix))
+        for n, b in _snap['bytes'].items():
+            _lines.append('{0:s}_bytes_total{{name="{1:s}"}} {2:d}'.format(prefix, n, b))
+        return '\n'.join(_lines) + '\n'
 
     @staticmethod
     def _time_execute(timeBegin, timeEnd=None, timeSize='ms'):
@@ -1,5 +1,12 @@
 from ctypes import *
-from asts import ASTS
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from tablestore import TableStore, Subscription
+from orderbook import OrderBooks
+from columnar import ColumnTable
+from schema import Schema
+import asts
 from metrics import Metrics
 
 class MTEMSG:
@@ -9,12 +16,165 @@ class MTEMSG:
             ('Data', c_char),
         ]
 
+    class LazyRow:
+        # Row holding the raw bytes of its fields; a field is decoded from cp1251 on first access and cached.
+        # _numbers is None for a full row, otherwise the field-number vector of a partial row
+        __slots__ = ('_raw', '_dec', '_numbers', '_spans', '_cache')
+
+        def __init__(self, _raw, _dec, _numbers=None):
+            self._raw = _raw
+            self._dec = _dec
+            self._numbers = _numbers
+            self._spans = _dec.spans if _numbers is None else None
+            self._cache = None
+
+        def _getSpans(self):
+            _spans = {}
+            _pos = 0
+            _selected = self._dec.selected
+            for i in self._numbers:
+                _end = _pos + self._dec.sizes[i]
+                if _selected is None or self._dec.names[i] in _selected:
+                    _spans[self._dec.names[i]] = (_pos, _end)
+                _pos = _end
+            self._spans = _spans
+            return _spans
+
+        def __getitem__(self, _name):
+            if self._cache is not None and _name in self._cache:
+                return self._cache[_name]
+            _b, _e = (self._spans if self._spans is not None else self._getSpans())[_name]
+            _val = self._raw[_b:_e].decode('cp1251')
+            if self._cache is None:
+                self._cache = {}
+            self._cache[_name] = _val
+            return _val
+
+        def __setitem__(self, _name, _value):
+            if self._cache is None:
+                self._cache = {}
+            self._cache[_name] = _value
+
+        def __contains__(self, _name):
+            return (self._cache is not None and _name in self._cache) or \
+                _name in (self._spans if self._spans is not None else self._getSpans())
+
+        def keys(self):
+            _keys = list(self._spans if self._spans is not None else self._getSpans())
+            if self._cache is not None:
+                _keys.extend(k for k in self._cache if k not in self._spans)
+            return _keys
+
+        def __iter__(self):
+            return iter(self.keys())
+
+        def __len__(self):
+            return len(self.keys())
+
+        def get(self, _name, _default=None):
+            return self[_name] if _name in self else _default
+
+        def items(self):
+            return [(k, self[k]) for k in self.keys()]
+
+        def values(self):
+            return [self[k] for k in self.keys()]
+
+        def update(self, _other):
+            for k in _other.keys():
+                self[k] = _other[k]
+
+        def __repr__(self):
+            return 'LazyRow({0})'.format(dict(self.items()))
+
+    class RowDecoder:
+        # Row header: number of fields in the vector (0 - full row) and length of the data block
+        _HEADER = struct.Struct('<BI')
+
+        def __init__(self, _flds, _lazy=False, _fields=None):
+            # _fields - names of the fields to keep (key fields are always kept), None - all fields
+            self.names = tuple(f['name'] for f in _flds)
+            self.sizes = tuple(f['size'] for f in _flds)
+            _ends = tuple(accumulate(self.sizes))
+            self.offsets = (0, ) + _ends[:-1]
+            self.rowSize = _ends[-1] if _ends else 0
+            self.selected = None
+            if _fields is not None:
+                self.selected = frozenset(_fields) | frozenset(f['name'] for f in _flds if f['key'])
+            self._full = tuple((n, b, e) for (n, b, e) in zip(self.names, self.offsets, _ends)
+                               if self.selected is None or n in self.selected)
+            self.spans = {n: (b, e) for (n, b, e) in self._full}
+            self.lazy = _lazy
+            if _lazy:
+                self.getRow = self.getLazyRow
+            elif self.selected is not None:
+                self.getRow = self.getProjectedRow
+
+        def getProjectedRow(self, _data, _offset):
+            # Only the selected fields are cut out and decoded, the others are skipped by offset
+            _cFld, _dataLen = MTEMSG.RowDecoder._HEADER.unpack_from(_data, _offset)
+            _offset += 5
+            if _cFld == 0:
+                _row = {n: str(_data[_offset + b:_offset + e], 'cp1251') for (n, b, e) in self._full if b < _dataLen}
+                return _row, _offset + _dataLen
+
+            _numberFlds = bytes(_data[_offset:_offset + _cFld])
+            _offset += _cFld
+            _names = self.names
+            _sizes = self.sizes
+            _selected = self.selected
+            _row = {}
+            _pos = _offset
+            for i in _numberFlds:
+                _end = _pos + _sizes[i]
+                if _names[i] in _selected:
+                    _row[_names[i]] = str(_data[_pos:_end], 'cp1251')
+                _pos = _end
+            return _row, _offset + _dataLen
+
+        def getLazyRow(self, _data, _offset):
+            _cFld, _dataLen = MTEMSG.RowDecoder._HEADER.unpack_from(_data, _offset)
+            _offset += 5
+            _numberFlds = None
+            if _cFld > 0:
+                _numberFlds = bytes(_data[_offset:_offset + _cFld])
+                _offset += _cFld
+            return MTEMSG.LazyRow(bytes(_data[_offset:_offset + _dataLen]), self, _numberFlds), _offset + _dataLen
+
+        def getRow(self, _data, _offset):
+            _cFld, _dataLen = MTEMSG.RowDecoder._HEADER.unpack_from(_data, _offset)
+            _offset += 5
+            if _cFld == 0:
+                # cp1251 is a single-byte encoding, so string positions match byte offsets
+                _str = str(_data[_offset:_offset + _dataLen], 'cp1251')
+                return {n: _str[b:e] for (n, b, e) in self._full}, _offset + _dataLen
+
+            _numberFlds = bytes(_data[_offset:_offset + _cFld])
+            _offset += _cFld
+            _str = str(_data[_offset:_offset + _dataLen], 'cp1251')
+            _names = self.names
+            _sizes = self.sizes
+            _row = {}
+            _pos = 0
+            for i in _numberFlds:
+                _end = _pos + _sizes[i]
+                _row[_names[i]] = _str[_pos:_end]
+                _pos = _end
+            return _row, _offset + _dataLen
+
     def __init__(self):
         self._msg = POINTER(MTEMSG.MSG)()
         self.MTEStructure = None
+        self.Schema = None
         self.ErrorStr = None
         self._version = None
         self.MTETables = {}
+        self.Updated = []
+        self._handles = {}
+        self._subscriptions = {}
+        self._indexes = {}
+        self._executor = None
+        self._parallelMin = 0
 
     def isMTEStructure(self):
         return self.MTEStructure != None
@@ -22,37 +182,50 @@ class MTEMSG:
     def pointer(self):
         return byref(self._msg)
 
+    def _isData(self, _res):
+        return _res in (asts.ASTS.MTE_OK, asts.ASTS.MTE_TSMR) or _res > asts.ASTS.MTE_OK
+
+    def rawData(self, _res):
+        # Whole reply block (DataLen and Data) as returned by libmtesrl
+        if not self._isData(_res) or not self._msg:
+            return b''
+        return string_at(self._msg, self._msg.contents.DataLen + 4)
+
+    def setData(self, _raw):
+        # Use a reply block from another source (a record file) as the current message
+        self._raw = create_string_buffer(_raw, len(_raw))
+        self._msg = cast(self._raw, POINTER(MTEMSG.MSG))
+
+    _UINT32 = struct.Struct('<I')
+
     def _toData(self):
         self._dataLen = self._msg.contents.DataLen
-        Metrics.info('Read: {0:,d} bytes'.format(self._dataLen))
+        if Metrics.noPrint == False:
+            Metrics.info('Read: {0:,d} bytes'.format(self._dataLen))
         Metrics.Var['LastRead'] = self._dataLen
-        self._data = cast(byref(self._msg[0]), POINTER(c_char * (self._dataLen + 4))).contents
+        Metrics.addBytes('MTEMSG.Read', self._dataLen)
+        # The buffer is owned by libmtesrl and stays valid until the next MTE call on the connection,
+        # so wrap it once and only copy out values as they are materialized
+        self._data = memoryview(cast(byref(self._msg[0]), POINTER(c_char * (self._dataLen + 4))).contents).cast('B')
         self._offset = 4
 
     def _getString(self):
-        _len = int.from_bytes(self._data[self._offset:self._offset + 4], byteorder='little', signed=False)
+        _len = MTEMSG._UINT32.unpack_from(self._data, self._offset)[0]
         self._offset += 4
-        _str = c_char_p(self._data[self._offset:self._offset + _len]).value.decode('cp1251')
+        _str = str(self._data[self._offset:self._offset + _len], 'cp1251').split('\x00', 1)[0]
         self._offset += _len
         return _str
 
     def _getInteger(self):
-        _int = int.from_bytes(self._data[self._offset:self._offset + 4], byteorder='little', signed=False)
+        _int = MTEMSG._UINT32.unpack_from(self._data, self._offset)[0]
         self._offset += 4
         return _int
 
     def _getByte(self):
-        _byte = self._data[self._offset:self._offset + 1]
+        _byte = self._data[self._offset]
         self._offset += 1
         return _byte
 
-    def _getByteList(self, _size):
-        _byte = []
-        for i in range(_size):
-            _byte.append(self._data[self._offset:self._offset + 1])
-            self._offset += 1
-        return _byte
-
     def _getByteArray(self, _size):
         _byte = self._data[self._offset:self._offset + _size]
         self._offset += _size
@@ -174,19 +347,20 @@ class MTEMSG:
     MSG_MODE_STRUCTURE = 0
     MSG_MODE_TABLE = 1
     def _prepareData(self, _res, mode = MSG_MODE_STRUCTURE):
-        if _res in (ASTS.MTE_OK, ASTS.MTE_TSMR) or _res > ASTS.MTE_OK:
+        if self._isData(_res):
             if mode == MTEMSG.MSG_MODE_STRUCTURE:
                 self.MTEStructure = None
+                self.Schema = None
             self.ErrorStr = None
             self._toData()
-            if _res == ASTS.MTE_TSMR:
-                self.ErrorStr = c_char_p(self._data[self._offset:]).value.decode('cp1251')
+            if _res == asts.ASTS.MTE_TSMR:
+                self.ErrorStr = bytes(self._data[self._offset:]).split(b'\x00', 1)[0].decode('cp1251')
 
     @Metrics()
     def toMTEStructure(self, _res, _vers):
         self._version = _vers
         self._prepareData(_res)
-        if _res == ASTS.MTE_OK:
+        if _res == asts.ASTS.MTE_OK:
             self.MTEStructure = {
                 'Версия': self._version,
                 'ИмяИнтерфейса': self._getString(),
@@ -197,85 +371,210 @@ class MTEMSG:
                 'Таблицы': self._getTables(),
                 'Транзакции': self._getTransactions(),
             }
+            self.Schema = Schema(self.MTEStructure)
+
+    def setMTEStructure(self, _structure):
+        self._version = _structure['Версия']
+        self.MTEStructure = _structure
+        self.Schema = Schema(_structure)
+
+    def _findTable(self, _table):
+        return self.Schema.table(_table)
 
     def _findTableFields(self, _table):
-        f = []
-        for tbl in self.MTEStructure['Таблицы']:
-            if tbl['Имя'] ==  _table:
-                for fld in tbl['ВыходныеПоля']:
-                    f.append({
-                        'name': fld['Имя'],
-                        'type': fld['Тип'],
-                        'size': fld['Размер'],
-                        'dec': fld['КолвоДесятичЗнаков'],
-                        'key': True if 'ffKey' in fld['Атрибуты'] else False,
-                    })
-        return f
-
-    def _getRow(self, _flds):
-        _cFld = int.from_bytes(self._getByte(), signed=False, byteorder='little')
-        _dataLen = self._getInteger()
-        _numberFlds = self._getByteList(_cFld) if _cFld > 0 else list(range(len(_flds)))
-        _dataFlds = self._getByteArray(_dataLen)
-        _offset = 0
-        _row = {}
-        for i in _numberFlds:
-            if isinstance(i, bytes):
-                i = int.from_bytes(i, signed=False, byteorder='little')
-            _row[_flds[i]['name']] = _dataFlds[_offset:_offset + _flds[i]['size']].decode('cp1251')
-            _offset += _flds[i]['size']
+        _tbl = self.Schema.table(_table)
+        return _tbl.fields if _tbl is not None else []
 
+    def _getRow(self, _dec):
+        _row, self._offset = _dec.getRow(self._data, self._offset)
         return _row
 
-    def _getRows(self, _flds):
+    def _getRows(self, _dec):
         _res = []
-        for i in range(self._getInteger()):
-            _res.append(self._getRow(_flds))
+        _count = self._getInteger()
+        _getRow = _dec.getRow
+        _data = self._data
+        _offset = self._offset
+        for i in range(_count):
+            _row, _offset = _getRow(_data, _offset)
+            _res.append(_row)
+        self._offset = _offset
         return _res
 
     @Metrics()
-    def toMTETable(self, _res, _table):
+    def toMTETable(self, _res, _table, _columnar=False, _params=None, _restore=None, _lazy=False, _fields=None):
         self._prepareData(_res, mode=MTEMSG.MSG_MODE_TABLE)
-        if _res < ASTS.MTE_OK:
+        if _res < asts.ASTS.MTE_OK:
             return _res
 
-        self._getTableData(_res, _table)
+        self._getTableData(_res, _table, _columnar, _params, _restore, _lazy, _fields)
 
     @Metrics()
     def toMTETables(self, _res):
         self._prepareData(_res, mode=MTEMSG.MSG_MODE_TABLE)
-        if _res < ASTS.MTE_OK:
+        if _res < asts.ASTS.MTE_OK:
             return _res
 
+        self.Updated = []
+        if self._executor is not None:
+            self._getTablesParallel()
+            return
         for i in range(self._getInteger()):
-            self._getTableData()
+            self.Updated.append(self._getTableData())
+
+    def setExecutor(self, _executor, minBytes=65536):
+        # concurrent.futures executor decoding the table blocks of a refresh in parallel, None - decode in place.
+        # Blocks shorter than minBytes and blocks of lazy tables are decoded in place.
+        # A process pool gets a copy of every block and returns the rows pickled
+        self._executor = _executor
+        self._parallelMin = minBytes
+
+    def _scanTables(self):
+        # First pass over a refresh: only row headers are read to find
+        # (handle, number of rows, offset of the first row, end of the block) of every table block
+        _blocks = []
+        _data = self._data
+        _unpack = MTEMSG._UINT32.unpack_from
+        _header = MTEMSG.RowDecoder._HEADER.unpack_from
+        _offset = self._offset
+        _tables = _unpack(_data, _offset)[0]
+        _offset += 4
+        for i in range(_tables):
+            _ref = _unpack(_data, _offset)[0]
+            _count = _unpack(_data, _offset + 4)[0]
+            _offset += 8
+            _begin = _offset
+            for j in range(_count):
+                _cFld, _dataLen = _header(_data, _offset)
+                _offset += 5 + _cFld + _dataLen
+            _blocks.append((_ref, _count, _begin, _offset))
+        return _blocks, _offset
+
+    @staticmethod
+    def _decodeBlock(_dec, _data, _offset, _count):
+        _res = []
+        _getRow = _dec.getRow
+        for i in range(_count):
+            _row, _offset = _getRow(_data, _offset)
+            _res.append(_row)
+        return _res
 
-    def _getTableData(self, _HTable=None, _tableName=None):
+    def _getTablesParallel(self):
+        # Blocks are decoded by the executor, the results are merged into the tables in message order
+        # on the calling thread, so stores, subscriptions and Updated see the same sequence as in place decoding
+        _blocks, _end = self._scanTables()
+        _inPlace = isinstance(self._executor, ThreadPoolExecutor)
+        _data = self._data
+        _jobs = []
+        for (_ref, _count, _begin, _blockEnd) in _blocks:
+            _dec = self.MTETables[_ref]['decoder']
+            if _dec.lazy or _blockEnd - _begin < self._parallelMin:
+                _jobs.append(None)
+            elif _inPlace:
+                _jobs.append(self._executor.submit(MTEMSG._decodeBlock, _dec, _data, _begin, _count))
+            else:
+                _jobs.append(self._executor.submit(MTEMSG._decodeBlock, _dec, bytes(_data[_begin:_blockEnd]), 0, _count))
+        for (_ref, _count, _begin, _blockEnd), _job in zip(_blocks, _jobs):
+            _tb = self.MTETables[_ref]
+            _tb['update'] = MTEMSG._decodeBlock(_tb['decoder'], _data, _begin, _count) if _job is None else _job.result()
+            _tb['rows'].update(_tb['update'])
+            self.Updated.append(_ref)
+        self._offset = _end
+
+    def _getTableData(self, _HTable=None, _tableName=None, _columnar=False, _params=None, _restore=None, _lazy=False, _fields=None):
         _ref = self._getInteger()
         if _HTable is not None:
             _fld = self._findTableFields(_tableName)
+            _flags = self._findTable(_tableName).attributes
+            _isBook = 'tfOrderbook' in _flags and OrderBooks.isOrderBook(_fld)
+            _decoder = MTEMSG.RowDecoder(_fld, _lazy, _fields if not _isBook or _fields is None else
+                                         tuple(_fields) + OrderBooks.FIELDS + ('QUANTITY', ))
+            if _decoder.selected is not None:
+                _fld = [f for f in _fld if f['name'] in _decoder.selected]
+            if _isBook:
+                _store = OrderBooks(_fld, _flags)
+            elif _columnar:
+                _store = ColumnTable(_fld, _flags)
+            else:
+                _store = TableStore(_fld, _flags, _tableName)
+                _store.listeners = self._subscriptions.setdefault(_tableName, [])
+                for i in self._indexes.get(_tableName, ()):
+                    _store.addIndex(*i)
             self.MTETables[_HTable] = {
                 'TableName': _tableName,
                 'HTable': _HTable,
                 'fields': _fld,
+                'decoder': _decoder,
+                'rows': _store,
+                'params': _params,
+                'columnar': _columnar,
             }
+            self._handles[_tableName] = _HTable
+            # Rows saved before a restart, the reply then carries only the changes since the snapshot
+            if _restore:
+                _store.update(_restore)
         else:
             _HTable = _ref
-            _fld = self.MTETables[_HTable]['fields']
-        self.MTETables[_HTable]['rows'] = self._getRows(_fld)
+        _tb = self.MTETables[_HTable]
+        # 'update' holds the rows delivered by the last reply, 'rows' - the merged table
+        _tb['update'] = self._getRows(_tb['decoder'])
+        _tb['rows'].update(_tb['update'])
+        return _HTable
 
     def closeMTETable(self, _Htable):
         if _Htable in self.MTETables:
+            if self._handles.get(self.MTETables[_Htable]['TableName']) == _Htable:
+                del self._handles[self.MTETables[_Htable]['TableName']]
             del self.MTETables[_Htable]
 
-    def TableData(self, _table):
+    def TableData(self, _table, _fields=None):
+        # _fields - return only these columns: a copy of the table entry with 'rows' as a list of dicts
         if isinstance(_table, str):
             _table = self.findTable(_table)
-        return self.MTETables[_table]
+        _tb = self.MTETables[_table]
+        if _fields is None:
+            return _tb
+        _res = dict(_tb)
+        _res['fields'] = [f for f in _tb['fields'] if f['name'] in _fields]
+        _res['rows'] = [{f: r[f] for f in _fields if f in r} for r in _tb['rows']]
+        _res['update'] = [{f: r[f] for f in _fields if f in r} for r in _tb['update']]
+        return _res
+
+    def OrderBook(self, _table, _secboard, _seccode):
+        _rows = self.TableData(_table)['rows']
+        return _rows.book(_secboard, _seccode) if isinstance(_rows, OrderBooks) else None
+
+    def subscribe(self, _table, _callback, keys=None, fields=None):
+        # Change notifications for a table, also for instances opened later (tables kept in TableStore only).
+        # Called during the decode of each reply, after the row is merged into the table (the callback gets the merged row)
+        _sub = Subscription(_table, _callback, keys, fields)
+        self._subscriptions.setdefault(_table, []).append(_sub)
+        return _sub
+
+    def unsubscribe(self, _sub):
+        _subs = self._subscriptions.get(_sub.table, [])
+        if _sub in _subs:
+            _subs.remove(_sub)
+
+    def addIndex(self, _table, *_fields):
+        # Secondary index of a table, kept for instances opened later (tables kept in TableStore only)
+        _indexes = self._indexes.setdefault(_table, [])
+        if _fields not in _indexes:
+            _indexes.append(_fields)
+        for h in self.findTables(_table):
+            _rows = self.MTETables[h]['rows']
+            if isinstance(_rows, TableStore):
+                _rows.addIndex(*_fields)
+
+    def query(self, _table, **_conditions):
+        _rows = self.TableData(_table)['rows']
+        if not isinstance(_rows, TableStore):
+            raise ValueError('{0:s} is not kept in TableStore'.format(str(_table)))
+        return _rows.query(**_conditions)
 
     def findTable(self, table):
-        for t in self.MTETables:
-            if self.MTETables[t]['TableName'] == table:
-                return t
+        return self._handles.get(table, -100)
 
-        return -100
\ No newline at end of file
+    def findTables(self, table):
+        # Handles of all the opened instances of a table
+        return [h for h in self.MTETables if self.MTETables[h]['TableName'] == table]
\ No newline at end of file
@@ -0,0 +1,122 @@
+from bisect import insort
+
+
+class OrderBook:
+    # Book of one instrument. Price levels are kept in dicts, their prices in ascending sorted lists:
+    # the best bid is the last bid price, the best offer is the first ask price
+    class Level:
+        __slots__ = ('price', 'quantity', 'rows')
+
+        def __init__(self, _price):
+            self.price = _price
+            self.quantity = 0
+            self.rows = []
+
+        def __repr__(self):
+            return 'Level({0}, {1})'.format(self.price, self.quantity)
+
+    __slots__ = ('bids', 'asks', '_bidPrices', '_askPrices', '_rowCount')
+
+    def __init__(self):
+        self._rowCount = 0
+        self.bids = {}
+        self.asks = {}
+        self._bidPrices = []
+        self._askPrices = []
+
+    def __len__(self):
+        return self._rowCount
+
+    def __iter__(self):
+        for p in reversed(self._bidPrices):
+            yield from self.bids[p].rows
+        for p in self._askPrices:
+            yield from self.asks[p].rows
+
+    def add(self, _row, _sort=True):
+        # A row without a price (the record of an instrument whose book became empty) adds nothing
+        try:
+            _price = float(_row['PRICE'])
+        except ValueError:
+            return False
+        try:
+            _quantity = int(_row.get('QUANTITY') or 0)
+        except ValueError:
+            _quantity = 0
+        if _row['BUYSELL'] == 'B':
+            _levels, _prices = self.bids, self._bidPrices
+        else:
+            _levels, _prices = self.asks, self._askPrices
+        _level = _levels.get(_price)
+        if _level is None:
+            _level = _levels[_price] = OrderBook.Level(_price)
+            if _sort:
+                insort(_prices, _price)
+            else:
+                _prices.append(_price)
+        _level.quantity += _quantity
+        _level.rows.append(_row)
+        self._rowCount += 1
+        return True
+
+    def sort(self):
+        self._bidPrices.sort()
+        self._askPrices.sort()
+
+    def bestBid(self):
+        return self.bids[self._bidPrices[-1]] if self._bidPrices else None
+
+    def bestOffer(self):
+        return self.asks[self._askPrices[0]] if self._askPrices else None
+
+    def topBids(self, _depth):
+        return [self.bids[p] for p in self._bidPrices[:-_depth - 1:-1]] if _depth > 0 else []
+
+    def topOffers(self, _depth):
+        return [self.asks[p] for p in self._askPrices[:_depth]] if _depth > 0 else []
+
+    def top(self, _depth):
+        return self.topBids(_depth), self.topOffers(_depth)
+
+
+class OrderBooks:
+    # Content of a tfOrderbook table: one OrderBook per (SECBOARD, SECCODE).
+    # Each update carries complete books of the instruments it contains, so only those are rebuilt
+    FIELDS = ('SECBOARD', 'SECCODE', 'BUYSELL', 'PRICE')
+
+    @staticmethod
+    def isOrderBook(_flds):
+        _names = set(f['name'] for f in _flds)
+        return all(f in _names for f in OrderBooks.FIELDS)
+
+    def __init__(self, _flds, _flags=()):
+        self.keys = tuple(f['name'] for f in _flds if f['key'])
+        self.clearOnUpdate = False
+        self.books = {}
+
+    def __len__(self):
+        return sum(len(b) for b in self.books.values())
+
+    def __iter__(self):
+        for b in self.books.values():
+            yield from b
+
+    def book(self, _secboard, _seccode):
+        return self.books.get((_secboard, _seccode))
+
+    def clear(self):
+        self.books.clear()
+
+    def update(self, _rows):
+        _books = {}
+        for _row in _rows:
+            _sec = (_row['SECBOARD'].strip(), _row['SECCODE'].strip())
+            _book = _books.get(_sec)
+            if _book is None:
+                _book = _books[_sec] = OrderBook()
+            # the instrument is replaced by the rows of this update, an empty book when none has a price
+            _book.add(_row, _sort=False)
+
+        for _sec, _book in _books.items():
+            _book.sort()
+            self.books[_sec] = _book
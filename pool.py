@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from asts import ASTS
+
+
+class MergedRows:
+    # Rows of one table opened on several connections, seen as one table
+    def __init__(self, _stores):
+        self._stores = _stores
+
+    def __len__(self):
+        return sum(len(s) for s in self._stores)
+
+    def __iter__(self):
+        return chain.from_iterable(self._stores)
+
+    def get(self, _key, _default=None):
+        for s in self._stores:
+            _row = s.get(_key) if hasattr(s, 'get') else None
+            if _row is not None:
+                return _row
+        return _default
+
+
+class ASTSPool:
+    # Independent MTE sessions with the same connection parameters. A board list is split across the sessions
+    # with MTESelectBoards, so each session loads only its share of a table; native calls release the GIL,
+    # so the sessions work in parallel threads
+    def __init__(self, params, size, LIBPATH=None, CACHEPATH=None):
+        self.params = params
+        self.connections = [ASTS(LIBPATH=LIBPATH, CACHEPATH=CACHEPATH) for i in range(size)]
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='ASTSPool')
+        self._tables = {}
+
+    def _map(self, _func, *iterables):
+        return list(self._executor.map(_func, *iterables))
+
+    def connect(self):
+        _res = self._map(lambda c: c.MTEConnect(self.params), self.connections)
+        # One structure for all the sessions
+        _first = self.connections[0]
+        if _first.isConnect() and _first.MTEStructureCached() == ASTS.MTE_OK:
+            for c in self.connections[1:]:
+                c._mtemsg.setMTEStructure(_first._mtemsg.MTEStructure)
+        return _res
+
+    def isConnect(self):
+        return all(c.isConnect() for c in self.connections)
+
+    def disconnect(self):
+        return self._map(lambda c: c.MTEDisconnect(), self.connections)
+
+    def close(self):
+        _res = self.disconnect()
+        self._executor.shutdown()
+        return _res
+
+    @staticmethod
+    def shard(_boards, _count):
+        if isinstance(_boards, str):
+            _boards = [b.strip() for b in _boards.split(',') if b.strip()]
+        _shards = [_boards[i::_count] for i in range(_count)]
+        return [s for s in _shards if s]
+
+    def _openShard(self, _conn, _boards, _table, _params, _complete, kwargs):
+        _res = _conn.MTESelectBoards(','.join(_boards))
+        if _res[0] != ASTS.MTE_OK:
+            return _res[0]
+        return _conn.MTEOpenTable(_table, _params, _complete, **kwargs)
+
+    def openTable(self, _table, _boards, _params='', _complete=True, **kwargs):
+        # Returns MTEOpenTable results of the sessions used
+        _shards = ASTSPool.shard(_boards, len(self.connections))
+        _conns = self.connections[:len(_shards)]
+        _res = self._map(lambda c, b: self._openShard(c, b, _table, _params, _complete, kwargs), _conns, _shards)
+        self._tables[_table] = [c for (c, r) in zip(_conns, _res) if r >= ASTS.MTE_OK]
+        return _res
+
+    def _refresh(self, _conn, _table):
+        _conn.MTEAddTable(_table)
+        return _conn.MTERefresh()
+
+    def refresh(self, _table):
+        return self._map(lambda c: self._refresh(c, _table), self._tables.get(_table, []))
+
+    def closeTable(self, _table):
+        return self._map(lambda c: c.MTECloseTable(_table), self._tables.pop(_table, []))
+
+    def TableData(self, _table):
+        _conns = self._tables[_table]
+        _tb = _conns[0].TableData(_table)
+        return {
+            'TableName': _table,
+            'fields': _tb['fields'],
+            'rows': MergedRows([c.TableData(_table)['rows'] for c in _conns]),
+        }
@@ -0,0 +1,91 @@
+import heapq
+from itertools import product
+
+
+class Query:
+    # Selection of TableStore rows. Conditions as in ColumnTable.mask: field=value equality,
+    # field=(lo, hi) inclusive range (None - open end), field=[v1, v2, ...] membership.
+    # Values are compared with TableStore.value: numbers for numeric fields, strings without padding for the others.
+    # Candidate rows come from the secondary indexes whose fields are all in the conditions,
+    # only the conditions not covered by them are checked row by row
+    def __init__(self, _store, _conditions=None):
+        self.store = _store
+        self.conditions = dict(_conditions) if _conditions else {}
+
+    def where(self, **_conditions):
+        _all = dict(self.conditions)
+        _all.update(_conditions)
+        return Query(self.store, _all)
+
+    @staticmethod
+    def _match(_value, _cond):
+        if isinstance(_cond, tuple):
+            _lo, _hi = _cond
+            return (_lo is None or _value >= _lo) and (_hi is None or _value <= _hi)
+        if isinstance(_cond, (list, set, frozenset)):
+            return _value in _cond
+        return _value == _cond
+
+    def _indexIds(self, _index):
+        _conds = [self.conditions[f] for f in _index.fields]
+        if not any(isinstance(c, tuple) for c in _conds):
+            _values = [c if isinstance(c, (list, set, frozenset)) else (c, ) for c in _conds]
+            _count = 1
+            for v in _values:
+                _count *= len(v)
+            if _count <= len(_index.values):
+                _sets = [_index.get(v) for v in product(*_values)]
+                # a copy, the sets of the index change with the next refresh
+                return set(_sets[0]) if len(_sets) == 1 else set().union(*_sets)
+        # ranges: the distinct values of the index are scanned instead of the rows
+        _ids = set()
+        for v, s in _index.values.items():
+            if all(Query._match(x, c) for (x, c) in zip(v, _conds)):
+                _ids |= s
+        return _ids
+
+    def _plan(self):
+        # (ids of the candidate rows, conditions left to check)
+        _sets = []
+        _covered = set()
+        for _fields, _index in self.store.indexes.items():
+            if all(f in self.conditions for f in _fields):
+                _sets.append(self._indexIds(_index))
+                _covered.update(_fields)
+        _left = {f: c for (f, c) in self.conditions.items() if f not in _covered}
+        if not _sets:
+            return self.store.ids(), _left
+        _sets.sort(key=len)
+        _ids = _sets[0]
+        for s in _sets[1:]:
+            _ids = _ids & s
+        return _ids, _left
+
+    def _rows(self):
+        _ids, _left = self._plan()
+        _rows = self.store.rowsById(_ids)
+        if not _left:
+            return _rows
+        _value = self.store.value
+        return [r for r in _rows if all(Query._match(_value(r, f), c) for (f, c) in _left.items())]
+
+    def rows(self):
+        return self._rows()
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def count(self):
+        _ids, _left = self._plan()
+        if not _left:
+            return len(_ids)
+        return len(self._rows())
+
+    def sum(self, _field):
+        _value = self.store.value
+        return sum(_value(r, _field) for r in self._rows())
+
+    def top(self, _n, _field, reverse=True):
+        # _n rows with the largest (reverse=False - smallest) values of a numeric field
+        _value = self.store.value
+        return (heapq.nlargest if reverse else heapq.nsmallest)(_n, self._rows(), key=lambda r: _value(r, _field))
@@ -0,0 +1,97 @@
+import pickle
+import struct
+import time
+
+
+class MTERecorder:
+    # Appends raw MTEMSG replies to a file. File: MAGIC, then frames of
+    # FRAME header (type, result, arg, time ns, name length, data length), name (utf-8), data.
+    # data is the whole MTEMSG block (DataLen and Data) as returned by libmtesrl;
+    # arg is the structure version for FRAME_STRUCTURE, name - the table name for FRAME_OPEN
+    MAGIC = b'MTEREC\x01\x00'
+    FRAME = struct.Struct('<BiiqHI')
+
+    FRAME_STRUCTURE = 0
+    FRAME_OPEN = 1
+    FRAME_REFRESH = 2
+    FRAME_CACHED_STRUCTURE = 3  # data is a pickled MTEStructure loaded from the local cache
+
+    def __init__(self, _fileName):
+        self.fileName = _fileName
+        self._fp = open(_fileName, 'ab')
+        if self._fp.tell() == 0:
+            self._fp.write(MTERecorder.MAGIC)
+
+    def record(self, _type, _res, _data, _name='', _arg=0):
+        _name = _name.encode('utf-8')
+        self._fp.write(MTERecorder.FRAME.pack(_type, _res, _arg, time.time_ns(), len(_name), len(_data)))
+        self._fp.write(_name)
+        self._fp.write(_data)
+
+    def recordStructure(self, _structure):
+        self.record(MTERecorder.FRAME_CACHED_STRUCTURE, 0, pickle.dumps(_structure, protocol=pickle.HIGHEST_PROTOCOL), _arg=_structure['Версия'])
+
+    def flush(self):
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class MTEReplayer:
+    # Feeds recorded frames back through MTEMSG, at the recorded pace (speed=1.0, 2.0 - twice as fast)
+    # or as fast as possible (speed=None)
+    def __init__(self, _fileName, _mtemsg=None, columnar=False):
+        self.fileName = _fileName
+        if _mtemsg is None:
+            # not at module level: asts imports this module and mtemsg imports asts
+            import mtemsg
+            _mtemsg = mtemsg.MTEMSG()
+        self.mtemsg = _mtemsg
+        self._columnar = columnar
+
+    def frames(self):
+        with open(self.fileName, 'rb') as fp:
+            if fp.read(len(MTERecorder.MAGIC)) != MTERecorder.MAGIC:
+                raise ValueError('{0:s} is not an MTE record file'.format(self.fileName))
+            while True:
+                _header = fp.read(MTERecorder.FRAME.size)
+                if len(_header) < MTERecorder.FRAME.size:
+                    return
+                _type, _res, _arg, _time, _nameLen, _dataLen = MTERecorder.FRAME.unpack(_header)
+                _name = fp.read(_nameLen).decode('utf-8')
+                yield {
+                    'type': _type,
+                    'res': _res,
+                    'arg': _arg,
+                    'time': _time,
+                    'name': _name,
+                    'data': fp.read(_dataLen),
+                }
+
+    def feed(self, _frame):
+        _msg = self.mtemsg
+        if _frame['type'] == MTERecorder.FRAME_CACHED_STRUCTURE:
+            _msg.setMTEStructure(pickle.loads(_frame['data']))
+            return
+        if _frame['data']:
+            _msg.setData(_frame['data'])
+        if _frame['type'] == MTERecorder.FRAME_STRUCTURE:
+            _msg.toMTEStructure(_frame['res'], _frame['arg'])
+        elif _frame['type'] == MTERecorder.FRAME_OPEN:
+            _msg.toMTETable(_frame['res'], _frame['name'], self._columnar)
+        elif _frame['type'] == MTERecorder.FRAME_REFRESH:
+            _msg.toMTETables(_frame['res'])
+
+    def replay(self, speed=None):
+        # Generator: feeds the frames one by one and yields each after it has been decoded
+        _start = None
+        for f in self.frames():
+            if speed:
+                if _start is None:
+                    _start = (f['time'], time.monotonic_ns())
+                _delay = (f['time'] - _start[0]) / speed - (time.monotonic_ns() - _start[1])
+                if _delay > 0:
+                    time.sleep(_delay / 1e9)
+            self.feed(f)
+            yield f
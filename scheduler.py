@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class RefreshScheduler:
+    # Owns an ASTS connection on a dedicated thread and polls MTERefresh continuously.
+    # Every registered table has its own cadence (interval, seconds; 0 - every refresh) and priority;
+    # decoded updates are put into the thread-safe queue `updates` as
+    # {'time', 'TableName', 'HTable', 'rows'} dicts, where 'rows' are the rows of that refresh.
+    # maxTables caps the tables of one MTERefresh: due tables go in by priority (then the longest overdue first),
+    # the rest wait for the next refresh; None - all due tables in one refresh, priority does not matter then.
+    # An exception of a refresh cycle is kept in lastError and the loop goes on after the idle pause.
+    # After start() all calls to the connection must go through call()
+    def __init__(self, _asts, idle=0.01, maxTables=None):
+        self._asts = _asts
+        self._idle = idle
+        self.maxTables = maxTables
+        self.updates = queue.Queue()
+        self.lastError = None
+        self._tables = {}
+        self._commands = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='RefreshScheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self._failPending()
+
+    def _failPending(self):
+        # Commands queued for a thread that no longer runs
+        while True:
+            try:
+                _future = self._commands.get_nowait()[0]
+            except queue.Empty:
+                return
+            if _future.set_running_or_notify_cancel():
+                _future.set_exception(RuntimeError('RefreshScheduler is stopped'))
+
+    def isRunning(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def call(self, _func, *args, **kwargs):
+        # Run _func(*args, **kwargs) on the connection thread, returns concurrent.futures.Future
+        _future = Future()
+        if self.isRunning():
+            self._commands.put((_future, _func, args, kwargs))
+        else:
+            RefreshScheduler._execute(_future, _func, args, kwargs)
+        return _future
+
+    @staticmethod
+    def _execute(_future, _func, args, kwargs):
+        if not _future.set_running_or_notify_cancel():
+            return
+        try:
+            _future.set_result(_func(*args, **kwargs))
+        except BaseException as e:
+            _future.set_exception(e)
+
+    def register(self, _table, interval=0.0, priority=0, params='', complete=False, **kwargs):
+        # Open the table on the connection thread and schedule its refreshes; the future returns MTEOpenTable result
+        return self.call(self._register, _table, interval, priority, params, complete, kwargs)
+
+    def unregister(self, _table):
+        return self.call(self._unregister, _table)
+
+    def _register(self, _table, _interval, _priority, _params, _complete, kwargs):
+        _res = self._asts.MTEOpenTable(_table, _params, _complete, **kwargs)
+        if _res < self._asts.MTE_OK:
+            return _res
+        self._publish(_res)
+        self._tables[_table] = {
+            'interval': _interval,
+            'priority': _priority,
+            'next': time.monotonic() + _interval,
+        }
+        return _res
+
+    def _unregister(self, _table):
+        if self._tables.pop(_table, None) is None:
+            return None
+        return self._asts.MTECloseTable(_table)
+
+    def _publish(self, _HTable):
+        _tb = self._asts.TableData(_HTable)
+        if _tb['update']:
+            self.updates.put({
+                'time': time.time(),
+                'TableName': _tb['TableName'],
+                'HTable': _HTable,
+                # copies: new rows are the stored rows, later refreshes merge into them on this thread
+                'rows': [dict(r) for r in _tb['update']],
+            })
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._cycle()
+                except Exception as e:
+                    self.lastError = e
+                    self._stop.wait(self._idle)
+        finally:
+            self._failPending()
+
+    def _cycle(self):
+        try:
+            while True:
+                RefreshScheduler._execute(*self._commands.get_nowait())
+        except queue.Empty:
+            pass
+
+        _now = time.monotonic()
+        _due = [t for t in self._tables if self._tables[t]['next'] <= _now]
+        if not _due:
+            _next = min([t['next'] for t in self._tables.values()], default=_now + self._idle)
+            self._stop.wait(min(max(_next - _now, 0), self._idle))
+            return
+
+        _due.sort(key=lambda t: (-self._tables[t]['priority'], self._tables[t]['next']))
+        if self.maxTables is not None:
+            _due = _due[:self.maxTables]
+        for t in _due:
+            self._asts.MTEAddTable(t)
+            self._tables[t]['next'] = _now + self._tables[t]['interval']
+
+        _res = self._asts.MTERefresh()
+        if _res != self._asts.MTE_OK:
+            self.lastError = _res
+            # tables with interval 0 are always due: do not spin on a lost connection
+            self._stop.wait(self._idle)
+            return
+        for h in self._asts.Updated():
+            self._publish(h)
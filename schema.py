@@ -0,0 +1,200 @@
+class ParamEncoder:
+    # Compiled layout of fixed-width input fields (ВходныеПоля of a transaction or a table).
+    # The default values are encoded once into a template; encoding fills the given fields into a copy of it.
+    # ftChar values are left-aligned and padded with spaces, other types are right-aligned and padded with zeros;
+    # int/float values of ftFixed fields are scaled by КолвоДесятичЗнаков
+    def __init__(self, _inputs):
+        self.fields = {}
+        _template = bytearray()
+        for f in _inputs:
+            self.fields[f.name] = (len(_template), f.size, f.type, f.dec or 0)
+            _template += ParamEncoder._pad(f.default or '', f.size, f.type, f.dec or 0, f.name)
+        self.size = len(_template)
+        self._template = bytes(_template)
+
+    @staticmethod
+    def _pad(_value, _size, _type, _dec, _name):
+        if isinstance(_value, (int, float)) and not isinstance(_value, bool):
+            _value = str(round(_value * 10 ** _dec)) if _type == 'ftFixed' else str(_value)
+        _value = _value.encode('cp1251') if isinstance(_value, str) else bytes(_value)
+        if len(_value) > _size:
+            raise ValueError('Value of {0:s} is longer than {1:d}'.format(_name, _size))
+        if _type == 'ftChar' or not _value:
+            return _value.ljust(_size, b' ')
+        return _value.rjust(_size, b'0')
+
+    def encode(self, _values=None, **kwargs):
+        _buf = bytearray(self._template)
+        for _values in (_values or {}, kwargs):
+            for n, v in _values.items():
+                _offset, _size, _type, _dec = self.fields[n]
+                _buf[_offset:_offset + _size] = ParamEncoder._pad(v, _size, _type, _dec, n)
+        return bytes(_buf)
+
+
+
+class Schema:
+    # Indexed view of MTEMSG.MTEStructure: tables, transactions and enum types by name,
+    # fields by name inside a table, attributes as bitmasks
+    FIELD_FLAGS = {'ffKey': 0x01, 'ffSecCode': 0x02, 'ffNotNull': 0x04, 'ffVarBlock': 0x08}
+    TABLE_FLAGS = {'tfUpdateable': 0x01, 'tfClearOnUpdate': 0x02, 'tfOrderbook': 0x04}
+
+    FF_KEY = 0x01
+    FF_SECCODE = 0x02
+    FF_NOTNULL = 0x04
+    FF_VARBLOCK = 0x08
+    TF_UPDATEABLE = 0x01
+    TF_CLEARONUPDATE = 0x02
+    TF_ORDERBOOK = 0x04
+
+    @staticmethod
+    def toInt(_value):
+        try:
+            return int(_value)
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def toFloat(_value):
+        try:
+            return float(_value)
+        except ValueError:
+            return float('nan')
+
+    @staticmethod
+    def numericConverter(_fld):
+        # Converter of the text of a numeric field (a field dict of MTEStructure) to its number:
+        # ftInteger - int, ftFixed - float scaled by КолвоДесятичЗнаков, ftFloat/ftFloatPoint - float as received.
+        # None for the other types. Shared by TableStore and ColumnTable, so both compare numbers the same way
+        if _fld['type'] == 'ftInteger':
+            return Schema.toInt
+        if _fld['type'] == 'ftFixed':
+            return lambda v, _s=10 ** (_fld['dec'] or 0): Schema.toFloat(v) / _s
+        if _fld['type'] in ('ftFloat', 'ftFloatPoint'):
+            return Schema.toFloat
+        return None
+
+    @staticmethod
+    def _flags(_names, _map):
+        _res = 0
+        for n in _names:
+            _res |= _map.get(n, 0)
+        return _res
+
+    class Field:
+        __slots__ = ('name', 'title', 'size', 'type', 'dec', 'attributes', 'flags', 'enum', 'default', 'index', 'offset')
+
+        def __init__(self, _fld, _index, _offset):
+            self.name = _fld['Имя']
+            self.title = _fld['Заголовок']
+            self.size = _fld['Размер']
+            self.type = _fld['Тип']
+            self.dec = _fld['КолвоДесятичЗнаков']
+            self.attributes = tuple(_fld['Атрибуты'])
+            self.flags = Schema._flags(_fld['Атрибуты'], Schema.FIELD_FLAGS)
+            self.enum = _fld['ПеречислимыйТип']
+            self.default = _fld['ЗначениеПоУмолчанию']
+            self.index = _index
+            self.offset = _offset
+
+        def isKey(self):
+            return bool(self.flags & Schema.FF_KEY)
+
+        def __repr__(self):
+            return 'Field({0:s}, {1:s}, {2:d})'.format(self.name, self.type, self.size)
+
+    @staticmethod
+    def _fields(_flds):
+        _res = []
+        _offset = 0
+        for i, f in enumerate(_flds):
+            _res.append(Schema.Field(f, i, _offset))
+            _offset += f['Размер']
+        return tuple(_res)
+
+    class Table:
+        __slots__ = ('name', 'title', 'index', 'attributes', 'flags', 'inputs', 'outputs', 'fieldIndex', 'fields')
+
+        def __init__(self, _tbl):
+            self.name = _tbl['Имя']
+            self.title = _tbl['Заголовок']
+            self.index = _tbl['ИндексСистемы']
+            self.attributes = tuple(_tbl['Атрибуты'])
+            self.flags = Schema._flags(_tbl['Атрибуты'], Schema.TABLE_FLAGS)
+            self.inputs = Schema._fields(_tbl['ВходныеПоля'])
+            self.outputs = Schema._fields(_tbl['ВыходныеПоля'])
+            self.fieldIndex = {f.name: f.index for f in self.outputs}
+            # Output fields in the form used by MTEMSG.MTETables[h]['fields']
+            self.fields = [{
+                'name': f.name,
+                'type': f.type,
+                'size': f.size,
+                'dec': f.dec,
+                'key': f.isKey(),
+            } for f in self.outputs]
+
+        def field(self, _name):
+            return self.outputs[self.fieldIndex[_name]]
+
+        def __repr__(self):
+            return 'Table({0:s})'.format(self.name)
+
+    class Transaction:
+        __slots__ = ('name', 'title', 'index', 'inputs')
+
+        def __init__(self, _trn):
+            self.name = _trn['Имя']
+            self.title = _trn['Заголовок']
+            self.index = _trn['ИндексСистемы']
+            self.inputs = Schema._fields(_trn['ВходныеПоля'])
+
+        def __repr__(self):
+            return 'Transaction({0:s})'.format(self.name)
+
+    class Enum:
+        __slots__ = ('name', 'title', 'size', 'kind', 'values', 'byTitle')
+
+        def __init__(self, _enm):
+            self.name = _enm['Имя']
+            self.title = _enm['Заголовок']
+            self.size = _enm['Размер']
+            self.kind = _enm['Тип']
+            self.values = {}
+            self.byTitle = {}
+            for c in _enm['Константа']:
+                # Structure version 1 has only the constant value
+                if isinstance(c, dict):
+                    self.values[c['Значение']] = c['КраткоеОписание']
+                    self.byTitle[c['КраткоеОписание']] = c['Значение']
+                else:
+                    self.values[c] = c
+                    self.byTitle[c] = c
+
+        def __repr__(self):
+            return 'Enum({0:s})'.format(self.name)
+
+    def __init__(self, _structure):
+        self.version = _structure['Версия']
+        self.tables = {t['Имя']: Schema.Table(t) for t in _structure['Таблицы']}
+        self.transactions = {t['Имя']: Schema.Transaction(t) for t in _structure['Транзакции']}
+        self.enums = {e['Имя']: Schema.Enum(e) for e in _structure['ПеречислимыеТипы']}
+        self._encoders = {}
+
+    def table(self, _name):
+        return self.tables.get(_name)
+
+    def transaction(self, _name):
+        return self.transactions.get(_name)
+
+    def enum(self, _name):
+        return self.enums.get(_name)
+
+    def paramEncoder(self, _table):
+        # ParamEncoder of the input fields of a table, compiled on first use
+        _enc = self._encoders.get(_table)
+        if _enc is None:
+            _enc = self._encoders[_table] = ParamEncoder(self.tables[_table].inputs)
+        return _enc
+
+    def encodeParams(self, _table, _values=None, **kwargs):
+        return self.paramEncoder(_table).encode(_values, **kwargs)
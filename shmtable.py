@@ -0,0 +1,300 @@
+import struct
+import time
+from multiprocessing import shared_memory, resource_tracker
+try:
+    import numpy as np
+except ImportError:
+    np = None
+from orderbook import OrderBooks
+
+
+class SharedTable:
+    # Layout of a table in a shared memory segment <prefix>_<TableName>:
+    #   HEADER - magic, number of fields, row size, capacity (slots), mode, version, rows, generation
+    #   FIELD * number of fields - name, offset in the row, size, key flag
+    #   slots - SLOT sequence followed by the row as fixed-width cp1251 text (the field layout of the wire row)
+    # One writer. version is a sequence lock over the whole table and every slot has its own one:
+    # the counter is odd while the writer changes the data. rows - used slots (MODE_KEYED, MODE_SNAPSHOT)
+    # or rows appended since creation (MODE_RING). generation changes when slots are reassigned to other keys
+    MAGIC = b'MTESHM\x01\x00'
+    HEADER = struct.Struct('<8sIIIIQQQ')
+    FIELD = struct.Struct('<32sIII')
+    SLOT = struct.Struct('<Q')
+    _VERSION = 24
+    _ROWS = 32
+    _GENERATION = 40
+
+    # rows with equal ffKey fields keep their slot
+    MODE_KEYED = 0
+    # tables without key fields: slots are a ring buffer of the last `capacity` rows
+    MODE_RING = 1
+    # tfClearOnUpdate and orderbook tables: the whole table is rewritten on every update
+    MODE_SNAPSHOT = 2
+
+    @staticmethod
+    def segmentName(_prefix, _table):
+        return '{0:s}_{1:s}'.format(_prefix, _table)
+
+    @staticmethod
+    def slotSize(_rowSize):
+        return (SharedTable.SLOT.size + _rowSize + 7) & ~7
+
+    @staticmethod
+    def dataOffset(_fieldCount):
+        return (SharedTable.HEADER.size + SharedTable.FIELD.size * _fieldCount + 7) & ~7
+
+
+class SharedTableWriter:
+    def __init__(self, _name, _fields, _keys, _mode, _capacity):
+        # _fields - (name, size) in row order; _keys - names of the key fields
+        self.name = _name
+        self.mode = _mode
+        self.capacity = _capacity
+        self.keys = tuple(_keys)
+        self.fields = tuple(_fields)
+        self.rowSize = sum(s for (n, s) in self.fields)
+        self._slotSize = SharedTable.slotSize(self.rowSize)
+        self._data = SharedTable.dataOffset(len(self.fields))
+        self.shm = shared_memory.SharedMemory(name=_name, create=True, size=self._data + self._slotSize * _capacity)
+        self._buf = self.shm.buf
+        self._version = 0
+        self._rows = 0
+        self._generation = 0
+        self._slots = {}
+
+        SharedTable.HEADER.pack_into(self._buf, 0, SharedTable.MAGIC, len(self.fields), self.rowSize, _capacity, _mode, 0, 0, 0)
+        _offset = 0
+        for i, (n, s) in enumerate(self.fields):
+            SharedTable.FIELD.pack_into(self._buf, SharedTable.HEADER.size + SharedTable.FIELD.size * i,
+                                        n.encode('cp1251'), _offset, s, 1 if n in self.keys else 0)
+            _offset += s
+
+    def _encode(self, _row):
+        return ''.join([_row.get(n, '').ljust(s)[:s] for (n, s) in self.fields]).encode('cp1251')
+
+    def _writeSlot(self, _slot, _row):
+        _buf = self._buf
+        _pos = self._data + self._slotSize * _slot
+        _seq = SharedTable.SLOT.unpack_from(_buf, _pos)[0]
+        SharedTable.SLOT.pack_into(_buf, _pos, _seq + 1)
+        _pos += SharedTable.SLOT.size
+        _buf[_pos:_pos + self.rowSize] = self._encode(_row)
+        SharedTable.SLOT.pack_into(_buf, _pos - SharedTable.SLOT.size, _seq + 2)
+
+    def _setVersion(self, _version):
+        self._version = _version
+        struct.pack_into('<Q', self._buf, SharedTable._VERSION, _version)
+
+    def write(self, _tb, _full=False):
+        # _tb - table of MTEMSG.MTETables; _full - write all rows of the table, not only the last update
+        self._setVersion(self._version + 1)
+        try:
+            if self.mode == SharedTable.MODE_SNAPSHOT:
+                self._writeSnapshot(_tb['rows'])
+            elif self.mode == SharedTable.MODE_RING:
+                for r in (_tb['rows'] if _full else _tb['update']):
+                    self._writeSlot(self._rows % self.capacity, r)
+                    self._rows += 1
+            else:
+                self._writeKeyed(_tb['rows'], _tb['rows'] if _full else _tb['update'])
+            struct.pack_into('<QQ', self._buf, SharedTable._ROWS, self._rows, self._generation)
+        finally:
+            self._setVersion(self._version + 1)
+
+    def _writeSnapshot(self, _rows):
+        _rows = list(_rows)
+        if len(_rows) > self.capacity:
+            raise OverflowError('{0:s}: {1:d} rows do not fit in {2:d} slots'.format(self.name, len(_rows), self.capacity))
+        for i, r in enumerate(_rows):
+            self._writeSlot(i, r)
+        self._rows = len(_rows)
+        self._generation += 1
+
+    def _writeKeyed(self, _store, _rows):
+        _slots = self._slots
+        for r in _rows:
+            _key = _store.rowKey(r)
+            _slot = _slots.get(_key)
+            if _slot is None:
+                if self._rows >= self.capacity:
+                    raise OverflowError('{0:s}: more than {1:d} rows'.format(self.name, self.capacity))
+                _slot = _slots[_key] = self._rows
+                self._rows += 1
+            # partial rows are merged into the stored row, the slot gets the whole row
+            self._writeSlot(_slot, _store.get(_key, r))
+
+    def close(self, unlink=True):
+        self._buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class SharedTableReader:
+    # Attaches to a table published by SharedTablePublisher. view()/array() give zero-copy access to the
+    # segment and are consistent only while `version` stays the same; row(), get() and rows() copy the bytes
+    # under the sequence locks and retry while the writer is active
+    def __init__(self, _table, prefix='moex'):
+        self.name = SharedTable.segmentName(prefix, _table)
+        self.shm = shared_memory.SharedMemory(name=self.name)
+        # The segment belongs to the publisher, the resource tracker of a reader must not unlink it on exit
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self._buf = self.shm.buf
+
+        _magic, _count, self.rowSize, self.capacity, self.mode, _v, _r, _g = SharedTable.HEADER.unpack_from(self._buf, 0)
+        if _magic != SharedTable.MAGIC:
+            raise ValueError('{0:s} is not a shared table'.format(self.name))
+        self.fields = []
+        self.keys = []
+        for i in range(_count):
+            _n, _offset, _size, _key = SharedTable.FIELD.unpack_from(self._buf, SharedTable.HEADER.size + SharedTable.FIELD.size * i)
+            _n = _n.rstrip(b'\x00').decode('cp1251')
+            self.fields.append((_n, _offset, _offset + _size))
+            if _key:
+                self.keys.append((_n, _offset, _offset + _size))
+        self._slotSize = SharedTable.slotSize(self.rowSize)
+        self._data = SharedTable.dataOffset(_count)
+        self._index = {}
+        self._indexed = 0
+        self._generation = None
+
+    @property
+    def version(self):
+        return struct.unpack_from('<Q', self._buf, SharedTable._VERSION)[0]
+
+    def _state(self):
+        # (version, rows, generation) read under the table lock
+        while True:
+            _v1 = self.version
+            if _v1 & 1:
+                time.sleep(0)
+                continue
+            _rows, _generation = struct.unpack_from('<QQ', self._buf, SharedTable._ROWS)
+            if self.version == _v1:
+                return _v1, _rows, _generation
+
+    def _decode(self, _raw):
+        _str = str(_raw, 'cp1251')
+        return {n: _str[b:e] for (n, b, e) in self.fields}
+
+    def view(self, _slot):
+        _pos = self._data + self._slotSize * _slot + SharedTable.SLOT.size
+        return self._buf[_pos:_pos + self.rowSize]
+
+    def _read(self, _slot):
+        _buf = self._buf
+        _pos = self._data + self._slotSize * _slot
+        _end = _pos + SharedTable.SLOT.size + self.rowSize
+        while True:
+            _seq = SharedTable.SLOT.unpack_from(_buf, _pos)[0]
+            if _seq & 1:
+                time.sleep(0)
+                continue
+            _raw = bytes(_buf[_pos + SharedTable.SLOT.size:_end])
+            if SharedTable.SLOT.unpack_from(_buf, _pos)[0] == _seq:
+                return _raw
+
+    def row(self, _slot):
+        return self._decode(self._read(_slot))
+
+    def _slotRange(self, _rows):
+        if self.mode == SharedTable.MODE_RING and _rows > self.capacity:
+            return [(_rows + i) % self.capacity for i in range(self.capacity)]
+        return range(min(_rows, self.capacity))
+
+    def rows(self):
+        # Consistent copy of the table: slots are copied under the table lock
+        while True:
+            _v, _rows, _g = self._state()
+            _raw = [self._read(s) for s in self._slotRange(_rows)]
+            if self.version == _v:
+                return [self._decode(r) for r in _raw]
+
+    def __iter__(self):
+        return iter(self.rows())
+
+    def __len__(self):
+        return min(self._state()[1], self.capacity)
+
+    def _sync(self):
+        # Key index of the slots: a slot keeps its key until the generation changes
+        _v, _rows, _generation = self._state()
+        if _generation != self._generation:
+            self._index = {}
+            self._indexed = 0
+            self._generation = _generation
+        for s in range(self._indexed, min(_rows, self.capacity)):
+            _raw = str(self._read(s), 'cp1251')
+            self._index[tuple(_raw[b:e].strip() for (n, b, e) in self.keys)] = s
+        self._indexed = max(self._indexed, min(_rows, self.capacity))
+
+    def get(self, _key, _default=None):
+        # _key - values of the key fields without padding
+        if self.mode == SharedTable.MODE_RING or not self.keys:
+            raise KeyError('{0:s} has no row key'.format(self.name))
+        self._sync()
+        _slot = self._index.get(tuple(_key))
+        if _slot is None:
+            return _default
+        return self.row(_slot)
+
+    def array(self):
+        # numpy structured array over the slots without copying: seq and one bytes column per field
+        if np is None:
+            raise ImportError('numpy is required for SharedTableReader.array')
+        _dtype = np.dtype({
+            'names': ['seq'] + [n for (n, b, e) in self.fields],
+            'formats': ['<u8'] + ['S{0:d}'.format(e - b) for (n, b, e) in self.fields],
+            'offsets': [0] + [SharedTable.SLOT.size + b for (n, b, e) in self.fields],
+            'itemsize': self._slotSize,
+        })
+        return np.ndarray((self.capacity, ), dtype=_dtype, buffer=self._buf, offset=self._data)
+
+    def close(self):
+        self._index = {}
+        self._buf = None
+        self.shm.close()
+
+
+class SharedTablePublisher:
+    # Owns the ASTS session and copies decoded tables into shared memory, so local processes read them
+    # through SharedTableReader without their own MTE sessions. update() goes after every MTERefresh
+    def __init__(self, _asts, prefix='moex', capacity=65536):
+        self._asts = _asts
+        self.prefix = prefix
+        self.capacity = capacity
+        self._writers = {}
+
+    def publish(self, _table, capacity=None):
+        # _table - handle or name of an opened table (not columnar)
+        _tb = self._asts.TableData(_table)
+        if _tb['columnar']:
+            raise ValueError('{0:s}: columnar tables can not be published'.format(_tb['TableName']))
+        _store = _tb['rows']
+        _dec = _tb['decoder']
+        if isinstance(_store, OrderBooks) or _store.clearOnUpdate:
+            _mode, _keys = SharedTable.MODE_SNAPSHOT, ()
+        elif _store.keys:
+            _mode, _keys = SharedTable.MODE_KEYED, _store.keys
+        else:
+            _mode, _keys = SharedTable.MODE_RING, ()
+        if _mode == SharedTable.MODE_SNAPSHOT:
+            _keys = tuple(f['name'] for f in _tb['fields'] if f['key'])
+
+        _writer = SharedTableWriter(SharedTable.segmentName(self.prefix, _tb['TableName']),
+                                    [(n, e - b) for (n, b, e) in _dec._full], _keys, _mode,
+                                    capacity if capacity is not None else self.capacity)
+        self._writers[_tb['HTable']] = _writer
+        _writer.write(_tb, _full=True)
+        return _writer.name
+
+    def update(self):
+        for h in self._asts.Updated():
+            _writer = self._writers.get(h)
+            if _writer is not None:
+                _writer.write(self._asts.TableData(h))
+
+    def close(self, unlink=True):
+        for w in self._writers.values():
+            w.close(unlink)
+        self._writers = {}
@@ -0,0 +1,67 @@
+import os
+import pickle
+from asts import ASTS
+
+
+class SnapshotStore:
+    # Session snapshot (MTEGetSnapshot) together with the decoded content of the opened tables.
+    # After a restart or reconnect the tables are reopened with MTEOpenTableAtSnapshot,
+    # so the gateway sends only the changes made after the snapshot
+    FORMAT = 1
+
+    def __init__(self, _fileName):
+        self.fileName = _fileName
+
+    def save(self, _asts):
+        _res, _snapshot = _asts.MTEGetSnapshot()
+        if _res != ASTS.MTE_OK:
+            return _res
+
+        _tables = []
+        for _tb in _asts._mtemsg.MTETables.values():
+            _tables.append({
+                'TableName': _tb['TableName'],
+                'params': _tb['params'] or '',
+                'columnar': _tb['columnar'],
+                # the decoder options of MTEOpenTable: the saved rows hold only the selected fields
+                'lazy': _tb['decoder'].lazy,
+                'fields': sorted(_tb['decoder'].selected) if _tb['decoder'].selected is not None else None,
+                # Columnar tables keep converted values, they are reloaded from the snapshot only
+                'rows': [dict(r) for r in _tb['rows']] if not _tb['columnar'] else None,
+            })
+
+        with open(self.fileName + '.tmp', 'wb') as fp:
+            pickle.dump({
+                'format': SnapshotStore.FORMAT,
+                'interface': _asts._interface,
+                'snapshot': _snapshot,
+                'tables': _tables,
+            }, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.fileName + '.tmp', self.fileName)
+        return _res
+
+    def load(self):
+        try:
+            with open(self.fileName, 'rb') as fp:
+                _data = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if not isinstance(_data, dict) or _data.get('format') != SnapshotStore.FORMAT:
+            return None
+        return _data
+
+    def restore(self, _asts):
+        # Reopen the saved tables on a connected ASTS. Returns {TableName: MTEOpenTableAtSnapshot result},
+        # tables that could not be opened at the snapshot are opened anew
+        _data = self.load()
+        if _data is None or _data['interface'] != _asts._interface:
+            return None
+
+        _res = {}
+        for t in _data['tables']:
+            _options = {'columnar': t['columnar'], 'lazy': t.get('lazy', False), 'fields': t.get('fields')}
+            r = _asts.MTEOpenTableAtSnapshot(t['TableName'], t['params'], _data['snapshot'], rows=t['rows'], **_options)
+            if r < ASTS.MTE_OK:
+                r = _asts.MTEOpenTable(t['TableName'], t['params'], True, **_options)
+            _res[t['TableName']] = r
+        return _res
@@ -0,0 +1,39 @@
+import os
+import pickle
+
+
+class StructureCache:
+    # Interface structures (MTEMSG.MTEStructure) stored as pickle files, one per interface and structure version.
+    # A cached structure is used only while the stored key (interface, structure version, server version) matches
+    FORMAT = 1
+
+    def __init__(self, _path):
+        self.path = _path
+
+    def _fileName(self, _interface, _version):
+        return os.path.join(self.path, '{0:s}.v{1:d}.structure'.format(_interface, _version))
+
+    def load(self, _interface, _version, _serverVersion):
+        try:
+            with open(self._fileName(_interface, _version), 'rb') as fp:
+                _data = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if not isinstance(_data, dict) or _data.get('format') != StructureCache.FORMAT:
+            return None
+        if _data.get('key') != (_interface, _version, _serverVersion):
+            return None
+        return _data['structure']
+
+    def save(self, _structure, _interface, _version, _serverVersion):
+        os.makedirs(self.path, exist_ok=True)
+        _fileName = self._fileName(_interface, _version)
+        with open(_fileName + '.tmp', 'wb') as fp:
+            pickle.dump({
+                'format': StructureCache.FORMAT,
+                'key': (_interface, _version, _serverVersion),
+                'НомерMsgSet': _structure.get('НомерMsgSet'),
+                'structure': _structure,
+            }, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(_fileName + '.tmp', _fileName)
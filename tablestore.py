@@ -0,0 +1,188 @@
+from query import Query
+from schema import Schema
+
+
+class Subscription:
+    # callback(tableName, key, changes, row): changes - {field: (old, new)} of the changed fields only,
+    # old is None for a new row; row - the stored row after the update, key is None for tables without key fields.
+    # keys - set of key tuples (values without padding), fields - set of field names
+    # An exception of the callback does not stop the decode: it is kept in lastError and counted in errors
+    __slots__ = ('table', 'callback', 'keys', 'fields', 'lastError', 'errors')
+
+    def __init__(self, _table, _callback, keys=None, fields=None):
+        self.table = _table
+        self.callback = _callback
+        self.keys = set(tuple(k) for k in keys) if keys is not None else None
+        self.fields = frozenset(fields) if fields is not None else None
+        self.lastError = None
+        self.errors = 0
+
+    def call(self, _table, _key, _changes, _row):
+        try:
+            self.callback(_table, _key, _changes, _row)
+        except Exception as e:
+            self.lastError = e
+            self.errors += 1
+
+
+class Index:
+    # Secondary index: values of the index fields (TableStore.value) -> ids of the rows in TableStore
+    __slots__ = ('fields', 'values', '_of')
+
+    def __init__(self, _fields):
+        self.fields = tuple(_fields)
+        self.values = {}
+        self._of = {}
+
+    def set(self, _id, _value):
+        _old = self._of.get(_id)
+        if _old == _value:
+            return
+        if _old is not None:
+            _ids = self.values[_old]
+            _ids.discard(_id)
+            if not _ids:
+                del self.values[_old]
+        self._of[_id] = _value
+        self.values.setdefault(_value, set()).add(_id)
+
+    def get(self, _value):
+        return self.values.get(_value, frozenset())
+
+    def clear(self):
+        self.values.clear()
+        self._of.clear()
+
+
+class TableStore:
+    # Current content of an opened table. Rows with equal ffKey fields are merged into one row,
+    # rows of tables without key fields are appended in arrival order
+    def __init__(self, _flds, _flags=(), _name=None):
+        self.name = _name
+        self.keys = tuple(f['name'] for f in _flds if f['key'])
+        self.clearOnUpdate = 'tfClearOnUpdate' in _flags
+        self.listeners = []
+        self.indexes = {}
+        self._convert = {}
+        for f in _flds:
+            _conv = Schema.numericConverter(f)
+            if _conv is not None:
+                self._convert[f['name']] = _conv
+        self._rows = {}
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows.values())
+
+    def rowKey(self, _row):
+        if not self.keys:
+            return None
+        try:
+            return tuple([_row[k] for k in self.keys])
+        except KeyError:
+            return None
+
+    def get(self, _key, _default=None):
+        return self._rows.get(_key, _default)
+
+    def clear(self):
+        self._rows.clear()
+        for i in self.indexes.values():
+            i.clear()
+
+    def value(self, _row, _name):
+        # Field value for comparisons: numbers for numeric fields (Schema.numericConverter),
+        # strings without padding for the others
+        _conv = self._convert.get(_name)
+        _value = _row.get(_name, '')
+        return _conv(_value) if _conv is not None else _value.strip()
+
+    def addIndex(self, *_fields):
+        _index = self.indexes.get(_fields)
+        if _index is None:
+            _index = self.indexes[_fields] = Index(_fields)
+            for _id, _row in self._rows.items():
+                _index.set(_id, tuple([self.value(_row, f) for f in _fields]))
+        return _index
+
+    def dropIndex(self, *_fields):
+        self.indexes.pop(_fields, None)
+
+    def _reindex(self, _id, _row, _changed):
+        # _changed - the fields that came in the update, None for a new row
+        for i in self.indexes.values():
+            if _changed is None or any(f in _changed for f in i.fields):
+                i.set(_id, tuple([self.value(_row, f) for f in i.fields]))
+
+    def rowsById(self, _ids):
+        _rows = self._rows
+        return [_rows[i] for i in _ids]
+
+    def ids(self):
+        return self._rows.keys()
+
+    def query(self, **_conditions):
+        return Query(self, _conditions)
+
+    @staticmethod
+    def _changes(_old, _row):
+        # Fields of a partial row are the ones the wire field vector marked as changed;
+        # values equal to the stored ones are not reported
+        if _old is None:
+            return {f: (None, v) for (f, v) in _row.items()}
+        _changes = {}
+        for f in _row.keys():
+            _new = _row[f]
+            _prev = _old[f] if f in _old else None
+            if _prev != _new:
+                _changes[f] = (_prev, _new)
+        return _changes
+
+    def _notify(self, _key, _changes, _row):
+        _stripped = None
+        # a callback may unsubscribe
+        for s in tuple(self.listeners):
+            if s.keys is not None:
+                if _key is None:
+                    continue
+                if _stripped is None:
+                    _stripped = tuple(v.strip() for v in _key)
+                if _stripped not in s.keys:
+                    continue
+            if s.fields is None:
+                s.call(self.name, _key, _changes, _row)
+                continue
+            _selected = {f: c for (f, c) in _changes.items() if f in s.fields}
+            if _selected:
+                s.call(self.name, _key, _selected, _row)
+
+    def update(self, _rows):
+        if self.clearOnUpdate:
+            self.clear()
+
+        _index = self._rows
+        _listeners = self.listeners
+        for _row in _rows:
+            _key = self.rowKey(_row)
+            if _key is None:
+                _index[self._seq] = _row
+                if self.indexes:
+                    self._reindex(self._seq, _row, None)
+                self._seq += 1
+                if _listeners:
+                    self._notify(None, self._changes(None, _row), _row)
+                continue
+
+            _old = _index.get(_key)
+            _changes = self._changes(_old, _row) if _listeners else None
+            if _old is None:
+                _index[_key] = _row
+            else:
+                _old.update(_row)
+            if self.indexes:
+                self._reindex(_key, _old if _old is not None else _row, None if _old is None else _row)
+            if _changes:
+                self._notify(_key, _changes, _old if _old is not None else _row)
@@ -0,0 +1,63 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter_ns
+from schema import ParamEncoder
+
+
+class Transactions:
+    # Transactions of one connection with precompiled parameter encoders and round-trip latency per transaction
+    LATENCY_SAMPLES = 1024
+
+    def __init__(self, _asts):
+        self._asts = _asts
+        self._encoders = {}
+        self.latency = {}
+
+    def encoder(self, _name):
+        _enc = self._encoders.get(_name)
+        if _enc is None:
+            _trn = self._asts._mtemsg.Schema.transaction(_name)
+            if _trn is None:
+                raise KeyError('Unknown transaction {0:s}'.format(_name))
+            _enc = self._encoders[_name] = ParamEncoder(_trn.inputs)
+            self.latency[_name] = deque(maxlen=Transactions.LATENCY_SAMPLES)
+        return _enc
+
+    def compile(self, _names=None):
+        for n in (_names if _names is not None else self._asts._mtemsg.Schema.transactions):
+            self.encoder(n)
+
+    def execute(self, _name, _values=None, clientIP=None, **kwargs):
+        # Returns (result, message) of MTEExecTrans
+        _params = self.encoder(_name).encode(_values, **kwargs)
+        _start = perf_counter_ns()
+        _res = self._asts.MTEExecTrans(_name, _params, clientIP)
+        self.latency[_name].append(perf_counter_ns() - _start)
+        return _res
+
+    def latencyStats(self, _name):
+        _lat = sorted(self.latency.get(_name, ()))
+        if not _lat:
+            return None
+        return {
+            'count': len(_lat),
+            'min': _lat[0],
+            'median': _lat[len(_lat) // 2],
+            'p99': _lat[min(len(_lat) - 1, len(_lat) * 99 // 100)],
+            'max': _lat[-1],
+        }
+
+    @staticmethod
+    def executeBatch(_transactions, _orders):
+        # _orders - list of (name, values); they are spread round-robin over the connections of _transactions
+        # and sent one after another on each connection, all connections in parallel. Results keep the order of _orders
+        _count = len(_transactions)
+        _results = [None] * len(_orders)
+
+        def _run(_idx):
+            for i in range(_idx, len(_orders), _count):
+                _results[i] = _transactions[_idx].execute(*_orders[i])
+
+        with ThreadPoolExecutor(max_workers=_count) as _executor:
+            list(_executor.map(_run, range(_count)))
+        return _results